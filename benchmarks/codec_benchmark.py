@@ -0,0 +1,62 @@
+import sys
+import os
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.codec import BinaryCodec, CodecType, MessageCodec  # noqa: E402
+from src.messages import Message, MessageArguments, MessageBuilder, MessageDecoder  # noqa: E402
+
+
+def build_messages():
+    search_message = Message('127.0.0.1:5001', 42, 99, 'SEARCH', {
+        MessageArguments.MODE.value: 'FL',
+        MessageArguments.LAST_HOP_PORT.value: '5003',
+        MessageArguments.KEY.value: 'chave_de_teste',
+        MessageArguments.HOP_COUNT.value: '3'
+    })
+    val_message = Message('127.0.0.1:5007', 11, 100, 'VAL', {
+        MessageArguments.MODE.value: 'BP',
+        MessageArguments.KEY.value: 'chave_de_teste',
+        MessageArguments.VALUE.value: 'valor_de_teste' * 4,
+        MessageArguments.HOP_COUNT.value: '5'
+    })
+    return {'SEARCH': search_message, 'VAL': val_message}
+
+
+def decode_to_message(data: bytes):
+    # Mesmo caminho de NodeServer.handle_received_message
+    return MessageBuilder.build_received_message(MessageCodec.decode(data))
+
+
+def forward_hop(data: bytes, codec_type: CodecType):
+    # Custo de um salto: decodifica, atualiza os campos do salto e codifica de novo
+    return MessageCodec.encode(decode_to_message(data).forward('5004'), codec_type)
+
+
+def measure(function, repetitions):
+    # Melhor de muitas rodadas curtas: rodadas longas quase sempre pegam
+    # interferencia de outros processos e as taxas variam de uma vez para outra
+    rounds = 50
+    number = max(1, repetitions // rounds)
+    seconds = min(timeit.repeat(function, number=number, repeat=rounds))
+    return number / seconds
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    print(f'{"mensagem":<8} {"codec":<7} {"bytes":>6} {"encode/s":>12} {"decode/s":>12} {"decode+Message/s":>17} {"salto/s":>12}')
+    for name, message in build_messages().items():
+        for codec_type in CodecType:
+            encoded = MessageCodec.encode(message, codec_type)
+            decode = BinaryCodec.decode if codec_type == CodecType.BINARY else MessageDecoder.decode
+            encode_rate = measure(
+                lambda: MessageCodec.encode(message, codec_type), repetitions)
+            decode_rate = measure(lambda: decode(encoded), repetitions)
+            message_rate = measure(lambda: decode_to_message(encoded),
+                                   repetitions)
+            hop_rate = measure(lambda: forward_hop(encoded, codec_type), repetitions)
+            print(f'{name:<8} {codec_type.value:<7} {len(encoded):>6} '
+                  f'{encode_rate:>12,.0f} {decode_rate:>12,.0f} {message_rate:>17,.0f} {hop_rate:>12,.0f}')
+
+
+if __name__ == '__main__':
+    main()
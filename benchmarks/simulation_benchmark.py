@@ -0,0 +1,115 @@
+import argparse
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.simulation import ModeReport, Simulation, Topology  # noqa: E402
+from src.commands import CommandMode, SEARCH_MODES  # noqa: E402
+from src.codec import CodecType  # noqa: E402
+from src.transport import TransportType  # noqa: E402
+from src.logs import NodeLogging  # noqa: E402
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Simula uma rede de nos em um unico processo e compara os modos de busca')
+    parser.add_argument('--nodes', type=int, default=100,
+                        help='numero de nos')
+    parser.add_argument('--topology', choices=Topology.NAMES, default='random',
+                        help='forma da rede gerada')
+    parser.add_argument('--transport', choices=Simulation.TRANSPORTS, default='memory',
+                        help='memory: entrega as mensagens em memoria; loopback: sockets em 127.0.0.1')
+    parser.add_argument('--modes', nargs='+', choices=SEARCH_MODES, default=SEARCH_MODES,
+                        help='modos de busca avaliados, nesta ordem')
+    parser.add_argument('--keys', type=int, default=100,
+                        help='numero de chaves distribuidas aleatoriamente entre os nos')
+    parser.add_argument('--searches', type=int, default=100,
+                        help='numero de buscas por modo')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='numero maximo de buscas em andamento ao mesmo tempo')
+    parser.add_argument('--timeout', type=float, default=5,
+                        help='tempo maximo (s) de espera pela resposta de cada busca')
+    parser.add_argument('--codec', choices=[x.value for x in CodecType], default=CodecType.BINARY.value,
+                        help='codec oferecido pelos nos no HELLO')
+    parser.add_argument('--base-port', type=int, default=20000,
+                        help='porta do primeiro no; os demais usam as portas seguintes')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='semente da topologia, das chaves e das buscas')
+    parser.add_argument('--ring-reports', action='store_true',
+                        help='os nos no limite de um anel ER avisam a origem, que para de aumentar o anel '
+                             'quando nenhum aviso chega')
+    parser.add_argument('--search-cancel', dest='cancel_searches', action='store_true',
+                        help='cancela as copias das buscas FL, ER e KW depois do primeiro VAL')
+    parser.add_argument('--val-routing', choices=['direct', 'reverse'], default='direct',
+                        help='reverse: o VAL volta pelo caminho da busca, deixando replicas nos nos')
+    parser.add_argument('--replica-cache-size', type=int, default=256,
+                        help='numero maximo de replicas por no com --val-routing reverse')
+    parser.add_argument('--key-digests', action='store_true',
+                        help='os nos trocam resumos das chaves e encaminham as buscas por eles')
+    parser.add_argument('--digest-depth', type=int, default=2,
+                        help='niveis dos resumos de chaves')
+    parser.add_argument('--adaptive-routing', action='store_true',
+                        help='RW e BP aprendem quais vizinhos levam as chaves')
+    parser.add_argument('--routing-exploration', type=float, default=0.1,
+                        help='fracao dos saltos escolhidos ao acaso com --adaptive-routing')
+    parser.add_argument('--fail-nodes', type=int, default=0,
+                        help='nos derrubados sem BYE antes das buscas')
+    parser.add_argument('--evict-after', type=int, default=3,
+                        help='envios seguidos que precisam falhar para um vizinho sair da tabela')
+    parser.add_argument('--worker-threads', type=int, default=16,
+                        help='threads de processamento por no (transporte loopback)')
+    parser.add_argument('--worker-queue-size', type=int, default=1024,
+                        help='fila de processamento por no (transporte loopback)')
+    parser.add_argument('--datagrams', action='store_true',
+                        help='SEARCH, VAL e CANCEL por UDP entre os nos (transporte loopback)')
+    parser.add_argument('--no-datagram-acks', dest='datagram_acks', action='store_false',
+                        help='buscas BP por datagrama sem confirmacao')
+    parser.add_argument('--key-skew', type=float, default=0,
+                        help='expoente da distribuicao de Zipf das chaves buscadas (0: uniforme)')
+    parser.add_argument('--verbose', action='store_true',
+                        help='mostra o log de todas as mensagens dos nos')
+    arguments = parser.parse_args()
+    if arguments.datagrams and arguments.transport != 'loopback':
+        parser.error('--datagrams exige --transport loopback')
+    return arguments
+
+
+def main():
+    arguments = parse_arguments()
+    adjacency = Topology.build(arguments.topology, arguments.nodes, arguments.seed)
+    simulation = Simulation(adjacency, arguments.transport, base_port=arguments.base_port,
+                            codec_type=CodecType(arguments.codec), send_timeout=arguments.timeout,
+                            node_options={'cancel_searches': arguments.cancel_searches,
+                                          'ring_reports': arguments.ring_reports,
+                                          'val_routing': arguments.val_routing,
+                                          'replica_cache_size': arguments.replica_cache_size,
+                                          'key_digests': arguments.key_digests,
+                                          'digest_depth': arguments.digest_depth,
+                                          'adaptive_routing': arguments.adaptive_routing,
+                                          'routing_exploration': arguments.routing_exploration,
+                                          'evict_after': arguments.evict_after,
+                                          'worker_threads': arguments.worker_threads,
+                                          'worker_queue_size': arguments.worker_queue_size,
+                                          'transport_type': TransportType.UDP if arguments.datagrams
+                                          else TransportType.TCP,
+                                          'datagram_acks': arguments.datagram_acks})
+    NodeLogging.configure('debug' if arguments.verbose else 'error')
+    edges = sum(len(x) for x in adjacency) // 2
+    print(f'Topologia {arguments.topology}: {arguments.nodes} nos, {edges} arestas, '
+          f'transporte {arguments.transport}')
+    simulation.start()
+    try:
+        simulation.place_keys(arguments.keys, arguments.seed)
+        simulation.fail_nodes(arguments.fail_nodes, arguments.seed)
+        ModeReport.print_header()
+        for mode in arguments.modes:
+            report = simulation.run_workload(CommandMode[mode], arguments.searches,
+                                             arguments.concurrency, arguments.timeout, arguments.seed,
+                                             arguments.key_skew)
+            report.print()
+    finally:
+        simulation.stop()
+        NodeLogging.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import time
+from src.host import HostManifest, NodeHost
+from src.simulation import Topology
+from src.metrics import MetricsExporter
+from src.logs import NodeLogging
+from main import add_logging_arguments, add_metrics_arguments, add_node_arguments, get_node_options, \
+    validate_arguments
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Roda os nos de um manifesto em um unico host, divididos entre processos, '
+                    'sem o menu interativo')
+    parser.add_argument('manifest',
+                        help='arquivo com uma linha por no: endereco:porta arquivo_de_vizinhos '
+                             '[arquivo_chave_valor]; com --generate, diretorio onde o manifesto e criado')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help='processos que dividem os nos, cada um com um event loop '
+                             '(padrao: um por nucleo)')
+    parser.add_argument('--duration', type=float,
+                        help='encerra os nos depois deste tempo (s); sem ele, rodam ate Ctrl+C')
+    parser.add_argument('--generate', choices=Topology.NAMES,
+                        help='gera o manifesto de uma rede com esta forma e encerra')
+    parser.add_argument('--nodes', type=int, default=100,
+                        help='numero de nos do manifesto gerado')
+    parser.add_argument('--keys', type=int, default=100,
+                        help='chaves distribuidas aleatoriamente entre os nos do manifesto gerado')
+    parser.add_argument('--address', default='127.0.0.1',
+                        help='endereco dos nos do manifesto gerado')
+    parser.add_argument('--base-port', type=int, default=20000,
+                        help='porta do primeiro no do manifesto gerado; os demais usam as seguintes')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='semente da topologia e das chaves do manifesto gerado')
+    add_node_arguments(parser)
+    add_metrics_arguments(parser)
+    add_logging_arguments(parser)
+    arguments = parser.parse_args()
+    validate_arguments(parser, arguments)
+    return arguments
+
+
+def generate_manifest(arguments):
+    adjacency = Topology.build(arguments.generate, arguments.nodes, arguments.seed)
+    path = HostManifest.write(arguments.manifest, adjacency, arguments.address, arguments.base_port,
+                              arguments.keys, arguments.seed)
+    print(f'Manifesto com {arguments.nodes} nos ({arguments.generate}) gravado em {path}')
+
+
+def main():
+    arguments = parse_arguments()
+    if arguments.generate:
+        generate_manifest(arguments)
+        return
+    try:
+        entries = HostManifest.read(arguments.manifest)
+    except (OSError, ValueError) as exception:
+        print(f'Erro ao ler o manifesto: {exception}')
+        return
+    if not entries:
+        print(f'Nenhum no em {arguments.manifest}')
+        return
+    log_options = {'level': arguments.log_level, 'quiet': arguments.quiet,
+                   'sampling': arguments.log_sample, 'rate_limits': arguments.log_rate_limit}
+    host = NodeHost(entries, arguments.processes, get_node_options(arguments), log_options)
+    NodeLogging.configure(log_queue=host.log_queue, **log_options)
+    try:
+        nodes, added, rejected = host.start()
+    except RuntimeError as exception:
+        print(f'Erro ao iniciar os nos: {exception}')
+        NodeLogging.stop()
+        return
+    print(f'{nodes} nos em {host.processes} processos: {added} vizinhos adicionados, '
+          f'{rejected} nao responderam')
+    metrics_exporter = MetricsExporter(host)
+    if arguments.metrics_port is not None:
+        metrics_exporter.start_http_server(arguments.metrics_address, arguments.metrics_port)
+    if arguments.metrics_file:
+        metrics_exporter.start_dump(arguments.metrics_file, arguments.metrics_interval)
+    deadline = time.monotonic() + arguments.duration if arguments.duration else None
+    try:
+        while host.is_alive() and (deadline is None or time.monotonic() < deadline):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    metrics_exporter.stop()
+    host.stop()
+    NodeLogging.stop()
+
+
+if __name__ == '__main__':
+    main()
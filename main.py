@@ -1,23 +1,251 @@
-import sys
+import argparse
 import threading
 from src.client import Client
 from src.node import NodeServer
+from src.async_node import AsyncNodeServer
 from src.messages import MessageBuilder
-import threading
+from src.framing import FramingType
+from src.codec import CodecType
+from src.transport import TransportType
+from src.commands import CommandMode, SEARCH_MODES
+from src.batch import BatchSearch
+from src.metrics import MetricsExporter
+from src.logs import CATEGORIES, LEVELS, NodeLogging
+
+
+SERVER_CLASSES = {
+    'thread': NodeServer,
+    'async': AsyncNodeServer
+}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('origin', help='endereco:porta do no')
+    parser.add_argument('neighbours', help='arquivo com a lista de vizinhos')
+    parser.add_argument('key_value', nargs='?', default='',
+                        help='arquivo com os pares chave valor')
+    parser.add_argument('--server-mode', choices=SERVER_CLASSES.keys(),
+                        default='thread',
+                        help='thread: uma thread por conexao; async: event loop asyncio')
+    add_node_arguments(parser)
+    parser.add_argument('--batch-keys',
+                        help='arquivo com uma chave por linha: executa as buscas sem o menu '
+                             'interativo, imprime os resultados e encerra o no')
+    parser.add_argument('--batch-mode', choices=SEARCH_MODES, default='FL',
+                        help='modo de busca usado no lote')
+    parser.add_argument('--batch-concurrency', type=int, default=16,
+                        help='numero maximo de buscas do lote em andamento ao mesmo tempo')
+    parser.add_argument('--batch-timeout', type=float, default=5,
+                        help='tempo maximo (s) de espera pela resposta de cada busca do lote')
+    add_metrics_arguments(parser)
+    add_logging_arguments(parser)
+    arguments = parser.parse_args()
+    validate_arguments(parser, arguments)
+    return arguments
+
+
+def add_node_arguments(parser):
+    # Opcoes de cada NodeServer, compartilhadas com o host.py
+    parser.add_argument('--framing', choices=[x.value for x in FramingType],
+                        default=FramingType.QUOTED.value,
+                        help='quoted: mensagens entre aspas; length: prefixo de tamanho de 4 bytes. '
+                             'Nos antigos recebem uma conexao por mensagem nos dois casos')
+    parser.add_argument('--send-timeout', type=float, default=5,
+                        help='tempo maximo (s) para conectar e enviar a cada vizinho')
+    parser.add_argument('--result-cache-size', type=int, default=1024,
+                        help='numero maximo de resultados de busca em cache (0 desativa)')
+    parser.add_argument('--result-cache-ttl', type=float, default=30,
+                        help='tempo (s) que um resultado de busca permanece em cache')
+    parser.add_argument('--codec', choices=[x.value for x in CodecType],
+                        default=CodecType.BINARY.value,
+                        help='binary: oferece o codec binario no HELLO e o usa com vizinhos que o '
+                             'suportam; text: usa apenas o formato de texto')
+    parser.add_argument('--key-store', choices=['dict', 'mmap'], default='dict',
+                        help='dict: carrega as chaves em memoria; mmap: mapeia o arquivo de chaves '
+                             'e consulta um indice (<arquivo>.idx, criado se necessario)')
+    parser.add_argument('--walkers', type=int, default=4,
+                        help='numero de caminhantes lancados por uma busca KW')
+    parser.add_argument('--walker-check-interval', type=int, default=4,
+                        help='a cada quantos saltos um caminhante KW volta a origem para saber se a busca '
+                             'ja foi respondida (0 desativa)')
+    parser.add_argument('--ring-hop-timeout', type=float, default=0.1,
+                        help='espera (s) por salto antes de uma busca ER aumentar o anel')
+    parser.add_argument('--ring-max-ttl', type=int,
+                        help='TTL do ultimo anel de uma busca ER (padrao: TTL das mensagens)')
+    parser.add_argument('--ring-reports', action='store_true',
+                        help='os nos em que o TTL de um anel ER acaba avisam a origem, que para de aumentar '
+                             'o anel quando nenhum aviso chega; todos os nos precisam da opcao. Desligado por '
+                             'padrao: custa mensagens nas buscas que acham a chave')
+    parser.add_argument('--search-cancel', dest='cancel_searches', action='store_true',
+                        help='cancela as copias de uma busca FL ou ER e os caminhantes KW depois do primeiro '
+                             'VAL; desligado por padrao, nas simulacoes nao reduziu o numero de mensagens')
+    parser.add_argument('--val-routing', choices=['direct', 'reverse'], default='direct',
+                        help='direct: o no que tem a chave envia o VAL direto a origem; reverse: o VAL volta '
+                             'pelo caminho da busca e os nos do caminho guardam replicas do valor')
+    parser.add_argument('--replica-cache-size', type=int, default=256,
+                        help='numero maximo de replicas guardadas com --val-routing reverse (0 desativa)')
+    parser.add_argument('--replica-cache-ttl', type=float, default=30,
+                        help='tempo (s) que uma replica permanece em cache')
+    parser.add_argument('--replica-admission', type=int, default=2,
+                        help='quantas buscas pela chave devem passar pelo no antes de ele guardar uma replica')
+    parser.add_argument('--key-digests', action='store_true',
+                        help='troca com os vizinhos resumos (filtros de Bloom) das chaves e encaminha as buscas '
+                             'preferindo os vizinhos cujo resumo pode conter a chave')
+    parser.add_argument('--digest-depth', type=int, default=2,
+                        help='niveis do resumo: o nivel i cobre as chaves a i saltos do vizinho')
+    parser.add_argument('--digest-bits', type=int, default=16384,
+                        help='tamanho de cada nivel do resumo em bits (multiplo de 8)')
+    parser.add_argument('--digest-interval', type=float, default=30,
+                        help='intervalo (s) entre as atualizacoes dos resumos enviados (0 desativa)')
+    parser.add_argument('--adaptive-routing', action='store_true',
+                        help='RW e BP escolhem o proximo salto pela taxa de sucesso e pelos saltos das buscas '
+                             'ja encaminhadas a cada vizinho, em vez de ao acaso')
+    parser.add_argument('--routing-exploration', type=float, default=0.1,
+                        help='fracao dos saltos de RW e BP escolhidos ao acaso com --adaptive-routing')
+    parser.add_argument('--routing-buckets', type=int, default=64,
+                        help='faixas de hash da chave com estatisticas proprias (1: so por vizinho)')
+    parser.add_argument('--heartbeat-interval', type=float, default=5,
+                        help='intervalo (s) entre os HELLOs enviados aos vizinhos para detectar falhas e '
+                             'readmitir vizinhos removidos (0 desativa)')
+    parser.add_argument('--evict-after', type=int, default=3,
+                        help='envios seguidos que precisam falhar para o vizinho sair da tabela')
+    parser.add_argument('--worker-threads', type=int, default=16,
+                        help='threads que processam as mensagens recebidas (servidor thread)')
+    parser.add_argument('--worker-queue-size', type=int, default=1024,
+                        help='mensagens recebidas aguardando processamento; com a fila cheia, copias repetidas '
+                             'de inundacoes e buscas com pouco TTL sao descartadas antes de HELLO, BYE e VAL')
+    parser.add_argument('--max-connections', type=int, default=256,
+                        help='numero maximo de conexoes recebidas abertas ao mesmo tempo')
+    parser.add_argument('--low-priority-ttl', type=int, default=1,
+                        help='buscas que chegam com TTL ate este valor tem prioridade baixa')
+    parser.add_argument('--transport', choices=[x.value for x in TransportType],
+                        default=TransportType.TCP.value,
+                        help='udp: SEARCH, VAL e CANCEL vao por datagrama aos vizinhos que tambem usam udp; '
+                             'HELLO, BYE e os resumos de chaves continuam por TCP')
+    parser.add_argument('--no-datagram-acks', dest='datagram_acks', action='store_false',
+                        help='nao espera confirmacao das buscas BP enviadas por datagrama')
+    parser.add_argument('--ack-timeout', type=float, default=0.2,
+                        help='espera (s) pela confirmacao de um datagrama antes de reenvia-lo')
+    parser.add_argument('--ack-retries', type=int, default=3,
+                        help='reenvios de um datagrama sem confirmacao antes de tentar outro vizinho')
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics-port', type=int,
+                        help='expoe as metricas do no em http://<metrics-address>:<porta>/metrics')
+    parser.add_argument('--metrics-address', default='127.0.0.1',
+                        help='endereco do servidor de metricas')
+    parser.add_argument('--metrics-file',
+                        help='arquivo sobrescrito periodicamente com as metricas do no')
+    parser.add_argument('--metrics-interval', type=float, default=10,
+                        help='intervalo (s) entre as escritas do arquivo de metricas')
+
+
+def add_logging_arguments(parser):
+    parser.add_argument('--log-level', choices=LEVELS, default='info',
+                        help='debug mostra cada mensagem recebida e enviada')
+    parser.add_argument('--quiet', action='store_true',
+                        help='mostra apenas erros no log')
+    parser.add_argument('--log-sample', action='append', metavar='CATEGORIA=N',
+                        help=f'registra um a cada N eventos da categoria ({", ".join(CATEGORIES)})')
+    parser.add_argument('--log-rate-limit', action='append', metavar='CATEGORIA=N',
+                        help='registra no maximo N eventos por segundo da categoria')
+
+
+def validate_arguments(parser, arguments):
+    try:
+        arguments.log_sample = NodeLogging.parse_category_values(
+            arguments.log_sample, int)
+        arguments.log_rate_limit = NodeLogging.parse_category_values(
+            arguments.log_rate_limit, float)
+    except ValueError as exception:
+        parser.error(str(exception))
+    # O codec binario limita cada texto a 65535 bytes, e o resumo vai em base64
+    if arguments.digest_bits <= 0 or arguments.digest_bits % 8 or arguments.digest_depth <= 0 or \
+            arguments.digest_depth * arguments.digest_bits // 6 > 65535:
+        parser.error('--digest-bits deve ser um multiplo de 8 positivo e --digest-depth * --digest-bits '
+                     'no maximo 393210')
+
+
+def get_node_options(arguments):
+    # Argumentos nomeados do NodeServer
+    return {'framing_type': FramingType(arguments.framing),
+            'send_timeout': arguments.send_timeout,
+            'result_cache_size': arguments.result_cache_size,
+            'result_cache_ttl': arguments.result_cache_ttl,
+            'codec_type': CodecType(arguments.codec),
+            'key_store': arguments.key_store,
+            'walkers': arguments.walkers,
+            'walker_check_interval': arguments.walker_check_interval,
+            'ring_hop_timeout': arguments.ring_hop_timeout,
+            'ring_max_ttl': arguments.ring_max_ttl,
+            'ring_reports': arguments.ring_reports,
+            'cancel_searches': arguments.cancel_searches,
+            'val_routing': arguments.val_routing,
+            'replica_cache_size': arguments.replica_cache_size,
+            'replica_cache_ttl': arguments.replica_cache_ttl,
+            'replica_admission': arguments.replica_admission,
+            'key_digests': arguments.key_digests,
+            'digest_depth': arguments.digest_depth,
+            'digest_bits': arguments.digest_bits,
+            'digest_interval': arguments.digest_interval,
+            'adaptive_routing': arguments.adaptive_routing,
+            'routing_exploration': arguments.routing_exploration,
+            'routing_buckets': arguments.routing_buckets,
+            'heartbeat_interval': arguments.heartbeat_interval,
+            'evict_after': arguments.evict_after,
+            'worker_threads': arguments.worker_threads,
+            'worker_queue_size': arguments.worker_queue_size,
+            'max_connections': arguments.max_connections,
+            'low_priority_ttl': arguments.low_priority_ttl,
+            'transport_type': TransportType(arguments.transport),
+            'datagram_acks': arguments.datagram_acks,
+            'ack_timeout': arguments.ack_timeout,
+            'ack_retries': arguments.ack_retries}
+
+
+def start_metrics_exporter(server, arguments):
+    exporter = MetricsExporter(server.metrics)
+    if arguments.metrics_port is not None:
+        exporter.start_http_server(arguments.metrics_address, arguments.metrics_port)
+    if arguments.metrics_file:
+        exporter.start_dump(arguments.metrics_file, arguments.metrics_interval)
+    return exporter
+
+
+def run_batch(server, arguments, server_thread):
+    keys = BatchSearch.read_keys(arguments.batch_keys)
+    while not server.listening.wait(1):
+        if not server_thread.is_alive():
+            return
+    batch = BatchSearch(server, CommandMode[arguments.batch_mode],
+                        arguments.batch_concurrency, arguments.batch_timeout)
+    try:
+        BatchSearch.print_results(batch.run(keys))
+    finally:
+        server.should_run_flag = False
+        server_thread.join()
 
 
 def main():
-    arguments = sys.argv
-    origin = arguments[1]
-    address, port = origin.split(':')
-    key_value = ''
-    if len(arguments) == 4:
-        key_value = arguments[3]
+    arguments = parse_arguments()
+    address, port = arguments.origin.split(':')
+    NodeLogging.configure(arguments.log_level, arguments.quiet,
+                          arguments.log_sample, arguments.log_rate_limit)
     message_builder = MessageBuilder()
-    server = NodeServer(address, port, arguments[2], key_value,
-                        True, message_builder)
-    client = Client(server)
+    server_class = SERVER_CLASSES[arguments.server_mode]
+    server = server_class(address, port, arguments.neighbours, arguments.key_value,
+                          True, message_builder, **get_node_options(arguments))
+    metrics_exporter = start_metrics_exporter(server, arguments)
     server_thread = threading.Thread(target=server.initialize_socket)
+    if arguments.batch_keys:
+        server_thread.start()
+        run_batch(server, arguments, server_thread)
+        metrics_exporter.stop()
+        NodeLogging.stop()
+        return
+    client = Client(server)
     client_thread = threading.Thread(target=client.run)
     running_threads = [server_thread, client_thread]
     for thread in running_threads:
@@ -25,6 +253,8 @@ def main():
 
     for thread in running_threads:
         thread.join()
+    metrics_exporter.stop()
+    NodeLogging.stop()
 
 
 if __name__ == '__main__':
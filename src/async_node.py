@@ -0,0 +1,243 @@
+import asyncio
+import threading
+import time
+from src.node import NodeServer
+from src.framing import FrameReader, FrameTooLargeException
+from src.connections import AsyncConnectionPool
+from src.logs import current_node, get_logger
+
+connection_log = get_logger('connections')
+
+
+class AsyncNodeServer(NodeServer):
+    def __init__(self, *args, **kwargs) -> None:
+        self.loop = None
+        self.loop_thread_id = None
+        # O HostShard roda os heartbeats e resumos de todos os seus nos numa
+        # unica tarefa e desliga a de cada no
+        self.shared_background_tasks = False
+        super().__init__(*args, **kwargs)
+        # So usado com o event loop rodando, depois do construtor
+        self.async_connection_pool = AsyncConnectionPool(self.send_timeout)
+
+    def define_metrics(self):
+        super().define_metrics()
+        self.metrics.define_gauge('outbound_connections', 'Conexoes abertas para vizinhos',
+                                  lambda: len(self.connection_pool.connections) +
+                                  len(self.async_connection_pool.connections))
+
+    def initialize_socket(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.running_tasks = set()
+        # Mensagens com envios em andamento, no mesmo limite da fila do
+        # WorkerPool do servidor com threads
+        self.message_tasks = set()
+        self.pending_messages = asyncio.Semaphore(self.worker_pool.queue_size)
+        self.socket = await asyncio.start_server(self.handle_request,
+                                                 self.address, int(self.port))
+        self.start_datagram_receiver()
+        self.listening.set()
+        await asyncio.to_thread(self.request_peer_codecs)
+        background_tasks = set()
+        if not self.shared_background_tasks:
+            background_tasks.add(asyncio.create_task(run_background_tasks([self])))
+        while self.should_run_flag:
+            await asyncio.sleep(1)
+        self.socket.close()
+        await self.socket.wait_closed()
+        if self.running_tasks or self.message_tasks or background_tasks:
+            await asyncio.gather(*self.running_tasks, *self.message_tasks, *background_tasks,
+                                 return_exceptions=True)
+        await self.async_connection_pool.close_all()
+        self.connection_pool.close_all()
+        self.loop = None
+
+    async def handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if len(self.running_tasks) >= self.max_connections:
+            connection_log.warning('Limite de %d conexoes atingido, recusando %s:%d',
+                                   self.max_connections, *writer.get_extra_info('peername')[:2])
+            self.metrics.increment('connections_rejected_total')
+            writer.close()
+            return
+        task = asyncio.current_task()
+        self.running_tasks.add(task)
+        frame_reader = FrameReader()
+        self.metrics.increment('inbound_connections')
+        try:
+            while self.should_run_flag:
+                try:
+                    data = await asyncio.wait_for(reader.read(4096), 1)
+                except asyncio.TimeoutError:
+                    continue
+                if not data:
+                    break
+                for message in frame_reader.feed(data):
+                    try:
+                        await self.handle_received_message(message, writer)
+                    except Exception as exception:
+                        connection_log.warning('Mensagem invalida descartada: %s', exception)
+        except FrameTooLargeException as exception:
+            connection_log.warning('Conexao descartada: %s', exception.message)
+        except OSError:
+            pass
+        finally:
+            writer.close()
+            self.running_tasks.discard(task)
+            self.metrics.increment('inbound_connections', -1)
+
+    def handle_received_datagram(self, data):
+        # Chamado pela thread que le o socket UDP
+        loop = self.loop
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self.handle_received_message(data, None), loop)
+
+    async def handle_received_message(self, message, conn):
+        # O comando roda na hora, na ordem de chegada; so a espera pelos
+        # envios vira tarefa, senao um vizinho lento trava a leitura de toda
+        # a conexao persistente de quem mandou a mensagem
+        await self.pending_messages.acquire()
+        try:
+            executed_commands = super().handle_received_message(message, conn)
+        except Exception:
+            self.pending_messages.release()
+            raise
+        task = self.loop.create_task(self.wait_for_sends(executed_commands))
+        self.message_tasks.add(task)
+        task.add_done_callback(self.message_tasks.discard)
+
+    async def wait_for_sends(self, executed_commands):
+        try:
+            for command in executed_commands:
+                await command.wait_for_sends()
+        finally:
+            self.pending_messages.release()
+
+    def is_loop_thread(self):
+        return self.loop is not None and threading.get_ident() == self.loop_thread_id
+
+    def send_message_to_target(self, message, target):
+        if self.loop is None:
+            return super().send_message_to_target(message, target)
+        coroutine = self.async_send_message_to_target(message, target)
+        if self.is_loop_thread():
+            return self.loop.create_task(coroutine)
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def send_to_next_hop(self, message, candidates, choose, on_choose=None, on_exhausted=None):
+        # No event loop o envio vira uma tarefa e nao levanta a falha aqui:
+        # a tentativa de cada candidato precisa ser aguardada
+        if not self.is_loop_thread():
+            return super().send_to_next_hop(message, candidates, choose, on_choose, on_exhausted)
+        return self.loop.create_task(
+            self.async_send_to_next_hop(message, candidates, choose, on_choose, on_exhausted))
+
+    async def async_send_to_next_hop(self, message, candidates, choose, on_choose, on_exhausted):
+        candidates = list(candidates)
+        while candidates:
+            neighbour = choose(message, candidates)
+            if on_choose is not None:
+                on_choose(neighbour)
+            try:
+                await self.async_send_message_to_target(message, neighbour)
+                return neighbour
+            except OSError as exception:
+                connection_log.warning('Erro ao enviar mensagem para %s: %s', neighbour, exception)
+                candidates.remove(neighbour)
+        if on_exhausted is not None:
+            pending_send = on_exhausted()
+            if asyncio.isfuture(pending_send):
+                await pending_send
+        return None
+
+    def close_connection(self, target):
+        super().close_connection(target)
+        if self.loop is None:
+            return
+        coroutine = self.async_connection_pool.close(target)
+        if self.is_loop_thread():
+            self.loop.create_task(coroutine)
+            return
+        asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def send_message_to_targets(self, message, targets):
+        if self.loop is None:
+            return super().send_message_to_targets(message, targets)
+        coroutine = self.async_send_message_to_targets(message, targets)
+        if self.is_loop_thread():
+            return self.loop.create_task(coroutine)
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def async_send_message_to_targets(self, message, targets):
+        copies = [(target, message) for target in targets]
+        if self.is_cancelled_copy(message):
+            copies = [(target, self.get_cancel_in_place(message, target)) for target in targets]
+            copies = [(target, copy) for target, copy in copies if copy is not None]
+        results = await asyncio.gather(*[asyncio.wait_for(self.async_send_message_to_target(copy, target),
+                                                          self.send_timeout)
+                                         for target, copy in copies], return_exceptions=True)
+        for (target, _), result in zip(copies, results):
+            if isinstance(result, Exception):
+                self.print_fanout_failure(target, result)
+
+    async def async_send_message_to_target(self, message, target):
+        self.print_sending_message(message, target)
+        started_at = time.monotonic()
+        try:
+            payload = self.encode_datagram(message, target)
+            if payload is not None and self.needs_datagram_ack(message):
+                # O TimeoutError sem ACK chega a async_send_to_next_hop
+                await self.datagram_transport.async_send_reliable(target, payload)
+            elif payload is not None:
+                self.datagram_transport.send(target, payload)
+            elif self.uses_persistent_connection(target):
+                await self.async_connection_pool.send(target, self.encode_message(message, target))
+            else:
+                address, port = target.split(':')
+                _, writer = await asyncio.wait_for(asyncio.open_connection(address, int(port)),
+                                                   self.send_timeout)
+                try:
+                    writer.write(self.encode_message(message, target))
+                    await writer.drain()
+                finally:
+                    writer.close()
+                    await writer.wait_closed()
+        except (OSError, asyncio.CancelledError):
+            self.record_send_failure(target)
+            raise
+        self.record_message_sent(message, target, started_at)
+        self.print_message_successfully_sent(message)
+
+
+async def run_background_tasks(nodes):
+    # Heartbeats e resumos de chaves dos nos de um event loop, numa unica
+    # tarefa no lugar de duas threads por no
+    now = time.monotonic()
+    jobs = []
+    for node in nodes:
+        if node.heartbeat_interval:
+            jobs.append([now + node.heartbeat_interval, node.heartbeat_interval, node, node.send_heartbeats])
+        if node.key_digests and node.digest_interval:
+            jobs.append([now + node.digest_interval, node.digest_interval, node, node.refresh_key_digests])
+    while jobs and any(node.should_run_flag for node in nodes):
+        # Acorda ao menos a cada segundo para notar o fim dos nos
+        next_run = min(job[0] for job in jobs)
+        await asyncio.sleep(min(max(next_run - time.monotonic(), 0), 1))
+        now = time.monotonic()
+        commands = []
+        for job in jobs:
+            next_run, interval, node, run = job
+            if next_run > now or not node.should_run_flag:
+                continue
+            job[0] = now + interval
+            current_node.set(node.origin)
+            try:
+                commands.extend(run())
+            except Exception as exception:
+                connection_log.warning('Erro na tarefa periodica de %s: %s', node.origin, exception)
+        # Os envios ja sao tarefas no loop; esperar por eles evita acumular
+        # rodadas quando os vizinhos demoram
+        await asyncio.gather(*[command.wait_for_sends() for command in commands])
@@ -0,0 +1,186 @@
+import concurrent.futures
+import threading
+import time
+from src.commands import CommandFactory, CommandMode, CommandType
+from src.messages import Message, MessageArguments, OperationType
+from src.logs import get_logger
+
+connection_log = get_logger('connections')
+
+
+class SearchRequest:
+    __slots__ = ('seq_number', 'key', 'mode', 'value', 'hop_count', 'rings', 'ring_truncated',
+                 'started_at', 'finished_at', 'deadline', 'event')
+
+    def __init__(self, seq_number, key, mode: CommandMode) -> None:
+        self.seq_number = seq_number
+        self.key = key
+        self.mode = mode
+        self.value = None
+        self.hop_count = None
+        # Numero de aneis usados por uma busca ER, e se algum no avisou que
+        # o anel atual acabou antes da rede
+        self.rings = None
+        self.ring_truncated = False
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        # Instante limite da busca; sem ele, a busca ER so para no TTL maximo
+        self.deadline = None
+        self.event = threading.Event()
+
+    def resolve(self, value, hop_count):
+        if self.event.is_set():
+            return
+        self.value = value
+        self.hop_count = int(hop_count)
+        self.finished_at = time.monotonic()
+        self.event.set()
+
+    def wait(self, timeout):
+        return self.event.wait(timeout)
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    @property
+    def timed_out(self):
+        return not self.event.is_set()
+
+    @property
+    def latency(self):
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+class PendingSearches:
+    def __init__(self, max_age=60) -> None:
+        self.max_age = max_age
+        # numero de sequencia da busca -> SearchRequest, em ordem de registro
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def register(self, seq_number, key, mode: CommandMode):
+        request = SearchRequest(seq_number, key, mode)
+        with self.lock:
+            self.__remove_expired(request.started_at)
+            self.requests.pop(seq_number, None)
+            self.requests[seq_number] = request
+        return request
+
+    def is_pending(self, seq_number):
+        return seq_number in self.requests
+
+    def get(self, seq_number):
+        return self.requests.get(seq_number)
+
+    def rekey(self, request: SearchRequest, seq_number):
+        with self.lock:
+            if self.requests.get(request.seq_number) is request:
+                del self.requests[request.seq_number]
+            request.seq_number = seq_number
+            if not request.event.is_set():
+                self.requests[seq_number] = request
+
+    def remove(self, request: SearchRequest):
+        with self.lock:
+            if self.requests.get(request.seq_number) is request:
+                del self.requests[request.seq_number]
+
+    def resolve(self, message: Message):
+        key = message.get_argument_val(MessageArguments.KEY)
+        with self.lock:
+            request = self.requests.get(message.seq_number)
+            if request is None or request.key != key:
+                # Nos antigos nao devolvem o numero de sequencia da busca no VAL
+                request = next(
+                    (x for x in self.requests.values() if x.key == key), None)
+            if request is None:
+                return None
+            del self.requests[request.seq_number]
+        request.resolve(message.get_argument_val(MessageArguments.VALUE),
+                        message.get_argument_val(MessageArguments.HOP_COUNT))
+        return request
+
+    def __remove_expired(self, now):
+        while self.requests:
+            seq_number, request = next(iter(self.requests.items()))
+            if now - request.started_at < self.max_age:
+                return
+            del self.requests[seq_number]
+
+    def __len__(self):
+        return len(self.requests)
+
+
+class BatchSearch:
+    def __init__(self, node, mode: CommandMode, concurrency=16, timeout=5) -> None:
+        self.node = node
+        self.mode = mode
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    @classmethod
+    def read_keys(cls, keys_file):
+        with open(keys_file, 'r') as file:
+            return [x.strip() for x in file.readlines() if x.strip()]
+
+    def run(self, keys):
+        if not keys:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.concurrency, len(keys)),
+                                                   thread_name_prefix='batch') as executor:
+            return list(executor.map(self.search, keys))
+
+    def search(self, key):
+        node = self.node
+        message = (node.message_builder
+                   .build_origin(node.origin)
+                   .build_operation(OperationType.SEARCH)
+                   .build_arguments({
+                       MessageArguments.MODE.value: self.mode.value,
+                       MessageArguments.LAST_HOP_PORT.value: str(node.port),
+                       MessageArguments.KEY.value: key,
+                       MessageArguments.HOP_COUNT.value: 1
+                   })
+                   .get_message())
+        # Registra antes de enviar: o VAL pode chegar antes do envio retornar
+        request = node.pending_searches.register(
+            message.seq_number, key, self.mode)
+        request.deadline = request.started_at + self.timeout
+        command = CommandFactory.create_command(CommandType.SEARCH, self.mode)
+        try:
+            result = command.execute_as_sender(node, message)
+        except OSError as exception:
+            connection_log.warning('Erro ao enviar busca pela chave %s: %s', key, exception)
+            node.pending_searches.remove(request)
+            return request
+        # A busca ER ja esperou pelos aneis dentro do prazo
+        wait = 0 if self.mode == CommandMode.ER else self.timeout
+        if command.success:
+            request.resolve(result, 0)
+        elif not request.wait(wait):
+            node.pending_searches.remove(request)
+        return request
+
+    @classmethod
+    def print_results(cls, requests):
+        print('chave modo valor saltos latencia_ms aneis')
+        for request in requests:
+            rings = request.rings if request.rings is not None else '-'
+            if request.timed_out:
+                print(f'{request.key} {request.mode.value} - - timeout {rings}')
+                continue
+            print(f'{request.key} {request.mode.value} {request.value} '
+                  f'{request.hop_count} {request.latency * 1000:.2f} {rings}')
+        found = [x for x in requests if not x.timed_out]
+        mean_latency = sum(x.latency for x in found) / \
+            len(found) if found else 0
+        mean_hops = sum(x.hop_count for x in found) / \
+            len(found) if found else 0
+        print(f'Encontradas: {len(found)}/{len(requests)} '
+              f'Timeouts: {len(requests) - len(found)} '
+              f'Media de saltos: {mean_hops:.2f} '
+              f'Latencia media: {mean_latency * 1000:.2f} ms')
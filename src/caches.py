@@ -0,0 +1,272 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+class SeenCache:
+    def __init__(self, window_size=1024, max_origins=4096) -> None:
+        self.window_size = window_size
+        self.max_origins = max_origins
+        # origem -> [maior numero de sequencia visto, mascara de bits]
+        # o bit i da mascara indica se (maior - i) ja foi visto
+        self.origins = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def check_and_add(self, origin, seq_number):
+        seq_number = int(seq_number)
+        with self.lock:
+            window = self.origins.get(origin)
+            if window is None:
+                self.__add_origin(origin, seq_number)
+                self.misses += 1
+                return False
+            self.origins.move_to_end(origin)
+            highest, mask = window
+            if seq_number > highest:
+                shift = seq_number - highest
+                window[0] = seq_number
+                # O seqno vem da rede: um salto grande nao pode virar um
+                # deslocamento gigante
+                if shift >= self.window_size:
+                    window[1] = 1
+                else:
+                    window[1] = ((mask << shift) | 1) & self.__window_mask()
+                self.misses += 1
+                return False
+            offset = highest - seq_number
+            if offset >= self.window_size:
+                # Muito antiga para a janela: nao ha como saber se ja foi
+                # vista, entao e descartada como repetida. Voltar a janela
+                # faria as mensagens recentes da origem parecerem novas.
+                self.hits += 1
+                return True
+            if mask & (1 << offset):
+                self.hits += 1
+                return True
+            window[1] = mask | (1 << offset)
+            self.misses += 1
+            return False
+
+    def contains(self, origin, seq_number):
+        seq_number = int(seq_number)
+        with self.lock:
+            window = self.origins.get(origin)
+            if window is None:
+                return False
+            highest, mask = window
+            offset = highest - seq_number
+            return 0 <= offset < self.window_size and bool(mask & (1 << offset))
+
+    def __add_origin(self, origin, seq_number):
+        self.origins[origin] = [seq_number, 1]
+        if len(self.origins) > self.max_origins:
+            self.origins.popitem(last=False)
+            self.evictions += 1
+
+    def __window_mask(self):
+        return (1 << self.window_size) - 1
+
+    def __len__(self):
+        return len(self.origins)
+
+
+class BPSearchState:
+    __slots__ = ('mother', 'active', 'visited', 'deadline')
+
+    def __init__(self, mother, visited, deadline) -> None:
+        self.mother = mother
+        self.active = ''
+        self.visited = visited
+        self.deadline = deadline
+
+    def remaining_neighbours(self, neighbours):
+        return [x for x in neighbours if x not in self.visited]
+
+    def visit(self, neighbour):
+        self.visited.add(neighbour)
+        self.active = neighbour
+
+
+class BPStateTable:
+    def __init__(self, max_entries=4096, expiry_seconds=60) -> None:
+        self.max_entries = max_entries
+        self.expiry_seconds = expiry_seconds
+        # Entradas em ordem de ultimo acesso: como o prazo e renovado a cada
+        # acesso, as primeiras entradas sao sempre as proximas a expirar.
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.expirations = 0
+        self.evictions = 0
+
+    def create(self, bp_key, mother, visited=()):
+        now = time.monotonic()
+        with self.lock:
+            self.__remove_expired(now)
+            state = BPSearchState(mother, set(visited),
+                                  now + self.expiry_seconds)
+            self.entries[bp_key] = state
+            self.entries.move_to_end(bp_key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return state
+
+    def get(self, bp_key):
+        now = time.monotonic()
+        with self.lock:
+            self.__remove_expired(now)
+            state = self.entries.get(bp_key)
+            if state is None:
+                return None
+            state.deadline = now + self.expiry_seconds
+            self.entries.move_to_end(bp_key)
+            return state
+
+    def remove(self, bp_key):
+        with self.lock:
+            self.entries.pop(bp_key, None)
+
+    def __remove_expired(self, now):
+        while self.entries:
+            bp_key, state = next(iter(self.entries.items()))
+            if state.deadline > now:
+                return
+            del self.entries[bp_key]
+            self.expirations += 1
+
+    def __contains__(self, bp_key):
+        return bp_key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ReversePathTable:
+    def __init__(self, max_entries=4096, expiry_seconds=30) -> None:
+        self.max_entries = max_entries
+        self.expiry_seconds = expiry_seconds
+        # origem:seqno da busca -> (vizinho de quem ela chegou primeiro,
+        # instante de expiracao), em ordem de chegada
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def add(self, origin, seq_number, previous_hop):
+        # So a primeira chegada conta: ela veio de um no que recebeu a busca
+        # antes deste, entao seguir esses vizinhos sempre leva a origem.
+        path_key = f'{origin}:{seq_number}'
+        now = time.monotonic()
+        with self.lock:
+            self.__remove_expired(now)
+            if path_key in self.entries:
+                return
+            self.entries[path_key] = (previous_hop, now + self.expiry_seconds)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, origin, seq_number):
+        with self.lock:
+            entry = self.entries.get(f'{origin}:{seq_number}')
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def __remove_expired(self, now):
+        while self.entries:
+            path_key, (_, expires_at) = next(iter(self.entries.items()))
+            if expires_at > now:
+                return
+            del self.entries[path_key]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ResultCache:
+    def __init__(self, capacity=1024, ttl_seconds=30) -> None:
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        # chave -> (valor, instante de expiracao), em ordem de ultimo acesso
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ReplicaCache(ResultCache):
+    # Valores que passaram por este no no caminho de volta de uma busca. Uma
+    # chave so e admitida depois de ser buscada admission_threshold vezes
+    # atraves deste no e, com o cache cheio, se for mais buscada que a
+    # proxima a sair.
+    def __init__(self, capacity=256, ttl_seconds=30, admission_threshold=2) -> None:
+        super().__init__(capacity, ttl_seconds)
+        self.admission_threshold = admission_threshold
+        # chave -> buscas recentes que passaram por este no; as contagens
+        # caem pela metade a cada capacity * 10 buscas
+        self.popularity = Counter()
+        self.recorded = 0
+        self.rejections = 0
+
+    def record_search(self, key):
+        if self.capacity <= 0:
+            return
+        with self.lock:
+            self.popularity[key] += 1
+            self.recorded += 1
+            if self.recorded < self.capacity * 10:
+                return
+            self.recorded = 0
+            self.popularity = Counter({key: count // 2 for key, count in self.popularity.items()
+                                       if count > 1})
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        with self.lock:
+            frequency = self.popularity.get(key, 0)
+            admitted = key in self.entries or (
+                frequency >= self.admission_threshold and
+                (len(self.entries) < self.capacity or
+                 frequency > self.popularity.get(next(iter(self.entries)), 0)))
+            if not admitted:
+                self.rejections += 1
+                return
+        super().put(key, value)
@@ -19,6 +19,8 @@ Escolha o comando
     [4] SEARCH (busca em profundidade)
     [5] Estatisticas
     [6] Alterar valor padrao de TTL
+    [7] SEARCH (k random walkers)
+    [8] SEARCH (flooding em aneis crescentes)
     [9] Sair    
         """
         while True:
@@ -40,7 +42,7 @@ Escolha o comando
                     neighbour_index = int(input())
                     command = CommandFactory.create_command(CommandType.HELLO)
                     self.server.execute_client_command(
-                        command, {}, self.server.neighbours[neighbour_index])
+                        command, self.server.get_hello_arguments(), self.server.neighbours[neighbour_index])
 
             case '2':
                 key = input('Digite a chave a ser buscada\n')
@@ -60,31 +62,53 @@ Escolha o comando
             case '5':
                 print('Estatisticas')
                 print(
-                    f'\tTotal de mensagens de flooding vistas: {self.server.stats_counter[CommandMode.FL.value]}')
+                    f'\tTotal de mensagens de flooding vistas: {self.server.get_stats_counter(CommandMode.FL)}')
                 print(
-                    f'\tTotal de mensagens de busca em profundidade vistas: {self.server.stats_counter[CommandMode.RW.value]}')
+                    f'\tTotal de mensagens de random walk vistas: {self.server.get_stats_counter(CommandMode.RW)}')
                 print(
-                    f'\tTotal de mensagens de busca em profundidade vistas: {self.server.stats_counter[CommandMode.BP.value]}')
-                fl_mean_list = self.server.stats_mean[CommandMode.FL.value]
-                fl_mean_val = fl_mean_list[0] / \
-                    fl_mean_list[1] if fl_mean_list[1] != 0 else 0
+                    f'\tTotal de mensagens de busca em profundidade vistas: {self.server.get_stats_counter(CommandMode.BP)}')
                 print(
-                    f'\tMedia de saltos ate encontrar destino por flooding: {fl_mean_val}')
-                rw_mean_list = self.server.stats_mean[CommandMode.RW.value]
-                rw_mean_val = rw_mean_list[0] / \
-                    rw_mean_list[1] if rw_mean_list[1] != 0 else 0
+                    f'\tTotal de mensagens de k random walkers vistas: {self.server.get_stats_counter(CommandMode.KW)}')
                 print(
-                    f'\tMedia de saltos ate encontrar destino por random walk: {rw_mean_val}')
-                bp_mean_list = self.server.stats_mean[CommandMode.BP.value]
-                bp_mean_val = bp_mean_list[0] / \
-                    bp_mean_list[1] if bp_mean_list[1] != 0 else 0
+                    f'\tTotal de mensagens de aneis crescentes vistas: {self.server.get_stats_counter(CommandMode.ER)}')
                 print(
-                    f'\tMedia de saltos ate encontrar destino por busca em profundidade: {bp_mean_val}')
+                    f'\tMedia de saltos ate encontrar destino por flooding: {self.server.get_stats_mean(CommandMode.FL)}')
+                print(
+                    f'\tMedia de saltos ate encontrar destino por random walk: {self.server.get_stats_mean(CommandMode.RW)}')
+                print(
+                    f'\tMedia de saltos ate encontrar destino por busca em profundidade: '
+                    f'{self.server.get_stats_mean(CommandMode.BP)}')
+                print(
+                    f'\tMedia de saltos ate encontrar destino por k random walkers: '
+                    f'{self.server.get_stats_mean(CommandMode.KW)}')
+                print(
+                    f'\tMedia de saltos ate encontrar destino por aneis crescentes: '
+                    f'{self.server.get_stats_mean(CommandMode.ER)}')
+                _, rings_mean = self.server.metrics.get('search_rings', mode=CommandMode.ER.value)
+                print(f'\tMedia de aneis por busca em aneis crescentes: {rings_mean}')
+                seen_cache = self.server.flooding_messages_seen
+                print(
+                    f'\tMensagens de flooding duplicadas descartadas: {seen_cache.hits}')
+                print(
+                    f'\tOrigens removidas do cache de mensagens vistas: {seen_cache.evictions}')
+                result_cache = self.server.result_cache
+                print(
+                    f'\tCache de resultados: {result_cache.hits} acertos, {result_cache.misses} falhas')
 
             case '6':
                 new_ttl = input('Digite novo valor de TTL\n')
                 self.server.message_builder.set_ttl(int(new_ttl))
 
+            case '7':
+                key = input('Digite a chave a ser buscada\n')
+                command_mode = CommandMode.KW
+                self.start_search_command(command_mode, key)
+
+            case '8':
+                key = input('Digite a chave a ser buscada\n')
+                command_mode = CommandMode.ER
+                self.start_search_command(command_mode, key)
+
             case '9':
                 command = CommandFactory.create_command(CommandType.BYE)
                 print('Saindo...')
@@ -0,0 +1,233 @@
+import struct
+from enum import Enum
+from functools import lru_cache
+from src.messages import Message, MessageArguments, MessageDecoder, OperationType
+
+
+class CodecType(Enum):
+    TEXT = 'text'
+    BINARY = 'binary'
+
+
+MODE = MessageArguments.MODE.value
+LAST_HOP_PORT = MessageArguments.LAST_HOP_PORT.value
+KEY = MessageArguments.KEY.value
+VALUE = MessageArguments.VALUE.value
+HOP_COUNT = MessageArguments.HOP_COUNT.value
+SEARCH = OperationType.SEARCH.value
+VAL = OperationType.VAL.value
+RVAL = OperationType.RVAL.value
+
+
+class BinaryCodec:
+    # magic | operacao << 4 | layout | numero de sequencia | TTL | tamanho da origem
+    HEADER = struct.Struct('!BBIiB')
+    # Layouts fixos para as mensagens com os argumentos padrao de cada operacao:
+    # cabecalho e campos saem num unico pack, seguidos da origem e dos textos
+    # SEARCH: cabecalho | modo | LAST_HOP_PORT | HOP_COUNT | tamanho da chave
+    SEARCH_MESSAGE = struct.Struct('!BBIiBBHHH')
+    # VAL e RVAL: cabecalho | modo | HOP_COUNT | tamanho da chave | tamanho do valor
+    VAL_MESSAGE = struct.Struct('!BBIiBBHHI')
+    # Layout generico: campo << 1 | tipo, seguido de inteiro ou texto com tamanho
+    FIELD_HEADER = struct.Struct('!B')
+    INT_FIELD = struct.Struct('!i')
+    STR_LENGTH = struct.Struct('!H')
+    MAGIC = 0xB1
+    NO_ARGUMENTS_LAYOUT = 0
+    FIXED_LAYOUT = 1
+    GENERIC_LAYOUT = 2
+    INT_TYPE = 0
+    STR_TYPE = 1
+    OPERATION_NAMES = [operation.value for operation in OperationType]
+    OPERATION_CODES = {operation: code for code,
+                       operation in enumerate(OPERATION_NAMES)}
+    # Segundo byte do cabecalho das operacoes com layout fixo
+    SEARCH_CODE = OPERATION_NAMES.index(SEARCH) << 4 | FIXED_LAYOUT
+    VAL_CODE = OPERATION_NAMES.index(VAL) << 4 | FIXED_LAYOUT
+    RVAL_CODE = OPERATION_NAMES.index(RVAL) << 4 | FIXED_LAYOUT
+    FIELD_NAMES = [field.value for field in MessageArguments]
+    FIELD_CODES = {field: code for code, field in enumerate(FIELD_NAMES)}
+    MODES = ['DEFAULT', 'FL', 'RW', 'BP', 'KW', 'ER']
+    MODE_CODES = {mode: code for code, mode in enumerate(MODES)}
+
+    @classmethod
+    def encode(cls, message: Message):
+        operation = message.operation
+        arguments = message.arguments
+        # Com quatro argumentos e todos os campos do layout presentes, sao
+        # exatamente os argumentos padrao da operacao
+        if len(arguments) == 4:
+            try:
+                if operation == SEARCH:
+                    return cls.__encode_search(message, arguments)
+                if operation == VAL:
+                    return cls.__encode_val(cls.VAL_CODE, message, arguments)
+                if operation == RVAL:
+                    return cls.__encode_val(cls.RVAL_CODE, message, arguments)
+            except (KeyError, ValueError, AttributeError, struct.error):
+                pass
+        origin = encode_text(message.origin)
+        if not arguments:
+            layout = cls.NO_ARGUMENTS_LAYOUT
+            body = b''
+        else:
+            layout = cls.GENERIC_LAYOUT
+            body = cls.__encode_generic_arguments(arguments)
+        header = cls.HEADER.pack(cls.MAGIC, cls.OPERATION_CODES[operation] << 4 | layout,
+                                 message.seq_number, message.ttl, len(origin))
+        return b''.join((header, origin, body))
+
+    @classmethod
+    def decode(cls, data: bytes):
+        operation_layout = data[1]
+        if operation_layout == cls.SEARCH_CODE:
+            return cls.__decode_search(data)
+        if operation_layout == cls.VAL_CODE or operation_layout == cls.RVAL_CODE:
+            return cls.__decode_val(data)
+        _, operation_layout, seq_number, ttl, origin_length = cls.HEADER.unpack_from(
+            data)
+        offset = cls.HEADER.size + origin_length
+        origin = decode_text(data[cls.HEADER.size:offset])
+        operation = cls.OPERATION_NAMES[operation_layout >> 4]
+        if operation_layout & 0x0F == cls.GENERIC_LAYOUT:
+            arguments = cls.__decode_generic_arguments(data, offset)
+        else:
+            arguments = ['DEFAULT', '', '', '']
+        return {
+            'ORIGIN': origin,
+            'SEQNO': seq_number,
+            'TTL': ttl,
+            'OPERATION': operation,
+            'ARGUMENTS': arguments
+        }
+
+    # Portas e contagens de saltos sempre sao geradas a partir de inteiros,
+    # entao podem ir como inteiros sem perder a representacao em texto.
+    @classmethod
+    def __encode_search(cls, message: Message, arguments: dict):
+        origin = encode_text(message.origin)
+        key = arguments[KEY].encode()
+        return b''.join((cls.SEARCH_MESSAGE.pack(
+            cls.MAGIC, cls.SEARCH_CODE, message.seq_number, message.ttl, len(origin),
+            cls.MODE_CODES[arguments[MODE]], int(arguments[LAST_HOP_PORT]), int(arguments[HOP_COUNT]),
+            len(key)), origin, key))
+
+    @classmethod
+    def __encode_val(cls, operation_layout, message: Message, arguments: dict):
+        origin = encode_text(message.origin)
+        key = arguments[KEY].encode()
+        value = arguments[VALUE].encode()
+        return b''.join((cls.VAL_MESSAGE.pack(
+            cls.MAGIC, operation_layout, message.seq_number, message.ttl, len(origin),
+            cls.MODE_CODES[arguments[MODE]], int(arguments[HOP_COUNT]), len(key), len(value)),
+            origin, key, value))
+
+    # Os demais modulos tratam os argumentos como texto, igual ao que sai
+    # do MessageDecoder.
+    @classmethod
+    def __decode_search(cls, data: bytes):
+        (_, _, seq_number, ttl, origin_length, mode, last_hop_port, hop_count,
+         key_length) = cls.SEARCH_MESSAGE.unpack_from(data)
+        offset = cls.SEARCH_MESSAGE.size + origin_length
+        return {
+            'ORIGIN': decode_text(data[cls.SEARCH_MESSAGE.size:offset]),
+            'SEQNO': seq_number,
+            'TTL': ttl,
+            'OPERATION': SEARCH,
+            'ARGUMENTS': {
+                MODE: cls.MODES[mode],
+                LAST_HOP_PORT: str(last_hop_port),
+                KEY: data[offset:offset + key_length].decode(),
+                HOP_COUNT: str(hop_count)
+            }
+        }
+
+    @classmethod
+    def __decode_val(cls, data: bytes):
+        (_, operation_layout, seq_number, ttl, origin_length, mode, hop_count, key_length,
+         value_length) = cls.VAL_MESSAGE.unpack_from(data)
+        offset = cls.VAL_MESSAGE.size + origin_length
+        value_offset = offset + key_length
+        return {
+            'ORIGIN': decode_text(data[cls.VAL_MESSAGE.size:offset]),
+            'SEQNO': seq_number,
+            'TTL': ttl,
+            'OPERATION': VAL if operation_layout == cls.VAL_CODE else RVAL,
+            'ARGUMENTS': {
+                MODE: cls.MODES[mode],
+                KEY: data[offset:value_offset].decode(),
+                VALUE: data[value_offset:value_offset + value_length].decode(),
+                HOP_COUNT: str(hop_count)
+            }
+        }
+
+    @classmethod
+    def __encode_generic_arguments(cls, arguments: dict):
+        parts = [bytes([len(arguments)])]
+        for field, value in arguments.items():
+            field_code = cls.FIELD_CODES[field] << 1
+            int_value = cls.__to_int(value)
+            if int_value is not None:
+                parts.append(cls.FIELD_HEADER.pack(field_code | cls.INT_TYPE))
+                parts.append(cls.INT_FIELD.pack(int_value))
+                continue
+            encoded_value = str(value).encode()
+            parts.append(cls.FIELD_HEADER.pack(field_code | cls.STR_TYPE))
+            parts.append(cls.STR_LENGTH.pack(len(encoded_value)))
+            parts.append(encoded_value)
+        return b''.join(parts)
+
+    @classmethod
+    def __decode_generic_arguments(cls, data: bytes, offset):
+        argument_count = data[offset]
+        offset += 1
+        arguments = {}
+        for _ in range(argument_count):
+            (field,) = cls.FIELD_HEADER.unpack_from(data, offset)
+            offset += cls.FIELD_HEADER.size
+            if field & 1 == cls.INT_TYPE:
+                (value,) = cls.INT_FIELD.unpack_from(data, offset)
+                offset += cls.INT_FIELD.size
+            else:
+                (length,) = cls.STR_LENGTH.unpack_from(data, offset)
+                offset += cls.STR_LENGTH.size
+                value = data[offset:offset + length].decode()
+                offset += length
+            arguments[cls.FIELD_NAMES[field >> 1]] = str(value)
+        return arguments
+
+    @classmethod
+    def __to_int(cls, value):
+        if isinstance(value, int):
+            return value if -2 ** 31 <= value < 2 ** 31 else None
+        # So vira inteiro se a volta para texto for identica ("007" fica texto)
+        if not (isinstance(value, str) and value.isascii() and value.isdigit()):
+            return None
+        int_value = int(value)
+        if int_value >= 2 ** 31 or str(int_value) != value:
+            return None
+        return int_value
+
+
+@lru_cache(maxsize=4096)
+def encode_text(text):
+    return text.encode()
+
+
+@lru_cache(maxsize=4096)
+def decode_text(data):
+    return data.decode()
+
+
+class MessageCodec:
+    @classmethod
+    def encode(cls, message: Message, codec_type: CodecType):
+        if codec_type == CodecType.BINARY:
+            return BinaryCodec.encode(message)
+        return str(message).encode()
+
+    @classmethod
+    def decode(cls, data: bytes):
+        if data[0] == BinaryCodec.MAGIC:
+            return BinaryCodec.decode(data)
+        return MessageDecoder.decode(data)
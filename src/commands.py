@@ -1,7 +1,13 @@
 from src.messages import Message, MessageArguments, OperationType
+from src.digests import KeyDigest
+import asyncio
 import random
 from enum import Enum
-import copy
+from src.logs import get_logger
+
+search_log = get_logger('search')
+neighbour_log = get_logger('neighbours')
+connection_log = get_logger('connections')
 
 
 class CommandType(Enum):
@@ -9,6 +15,10 @@ class CommandType(Enum):
     BYE = "BYE"
     SEARCH = "SEARCH"
     VAL = "VAL"
+    CANCEL = "CANCEL"
+    RVAL = "RVAL"
+    DIGEST = "DIGEST"
+    RING = "RING"
 
 
 class CommandMode(Enum):
@@ -16,6 +26,14 @@ class CommandMode(Enum):
     FL = 'FL'
     RW = 'RW'
     BP = 'BP'
+    KW = 'KW'
+    ER = 'ER'
+
+
+SEARCH_MODES = [x.value for x in CommandMode if x != CommandMode.DEFAULT]
+# Modos em que copias ou caminhantes da busca continuam circulando depois do
+# primeiro VAL; cada salto confere a marca de busca respondida
+CANCELLABLE_MODES = [CommandMode.FL, CommandMode.ER, CommandMode.KW]
 
 
 class ICommand:
@@ -23,8 +41,46 @@ class ICommand:
     def __init__(self) -> None:
         self.success = True
         self.command = ''
+        self.pending_sends = []
         pass
 
+    def send_message(self, node, message: Message, target):
+        pending_send = node.send_message_to_target(message, target)
+        if asyncio.isfuture(pending_send):
+            self.pending_sends.append(pending_send)
+        return pending_send
+
+    def send_message_to_all(self, node, message: Message, targets):
+        pending_send = node.send_message_to_targets(message, targets)
+        if asyncio.isfuture(pending_send):
+            self.pending_sends.append(pending_send)
+        return pending_send
+
+    def send_to_next_hop(self, node, message: Message, candidates, choose=None, on_choose=None,
+                         on_exhausted=None):
+        pending_send = node.send_to_next_hop(message, candidates, choose or node.choose_next_hop,
+                                             on_choose, on_exhausted)
+        if asyncio.isfuture(pending_send):
+            self.pending_sends.append(pending_send)
+        return pending_send
+
+    @classmethod
+    def when_sent(cls, pending_send, callback):
+        # No servidor asyncio o envio so termina depois: o callback espera
+        # o resultado e nao roda se ele falhar
+        if not asyncio.isfuture(pending_send):
+            callback()
+            return
+        pending_send.add_done_callback(
+            lambda future: callback() if not future.cancelled() and future.exception() is None else None)
+
+    async def wait_for_sends(self):
+        results = await asyncio.gather(*self.pending_sends, return_exceptions=True)
+        self.pending_sends = []
+        for result in results:
+            if isinstance(result, Exception):
+                connection_log.warning('Erro ao enviar mensagem: %s', result)
+
     def execute_as_sender(self, node, message: Message, target=None):
         raise NotImplementedError
 
@@ -44,6 +100,14 @@ class CommandFactory:
             return ValCommand(mode_val)
         if command_type == CommandType.SEARCH:
             return SearchCommand(mode_val)
+        if command_type == CommandType.CANCEL:
+            return CancelCommand(mode_val)
+        if command_type == CommandType.RVAL:
+            return RValCommand(mode_val)
+        if command_type == CommandType.DIGEST:
+            return DigestCommand()
+        if command_type == CommandType.RING:
+            return RingCommand()
         raise NotImplementedError
 
 
@@ -55,18 +119,45 @@ class HelloCommand(ICommand):
 
     def execute_as_sender(self, node, message: Message, target):
         try:
-            node.send_message_to_target(message, target)
+            pending_send = self.send_message(node, message, target)
         except:
-            print('Erro ao conectar!')
+            connection_log.warning('Erro ao conectar a %s', target)
             self.success = False
+            return
+        if self.has_codecs(message):
+            self.when_sent(pending_send, lambda: node.codecs_announced.add(target))
 
     def execute_as_receiver(self, node, message: Message, target=None):
         origin = message.origin
-        if origin in node.neighbours:
-            print(f'\tVizinho ja esta na tabela: {origin}')
+        if node.failure_detector.record_success(origin):
+            node.readmit_neighbour(origin)
+        elif node.add_neighbour(origin):
+            neighbour_log.info('\tAdicionando vizinho na tabela: %s', origin)
         else:
-            print(f'\tAdicionando vizinho na tabela: {origin}')
-            node.neighbours.append(origin)
+            # Com heartbeats, todo vizinho repete o HELLO periodicamente
+            neighbour_log.debug('\tVizinho ja esta na tabela: %s', origin)
+        had_codecs = origin in node.peer_codecs
+        node.register_peer_codecs(
+            origin, message.get_argument_val(MessageArguments.CODECS))
+        if node.key_digests and origin in node.peer_codecs and not had_codecs:
+            # Vizinho que acabou de negociar: precisa do resumo de chaves atual
+            digest_command = node.send_key_digest(origin)
+            if digest_command is not None:
+                self.pending_sends += digest_command.pending_sends
+        if not self.has_codecs(message) or origin in node.codecs_announced:
+            return
+        # O vizinho so descobre os codecs deste no se receber um HELLO dele
+        hello_message = node.build_hello_message()
+        if not self.has_codecs(hello_message):
+            return
+        try:
+            self.send_message(node, hello_message, origin)
+            node.codecs_announced.add(origin)
+        except OSError:
+            connection_log.warning('Erro ao conectar a %s', origin)
+
+    def has_codecs(self, message: Message):
+        return message.get_argument_val(MessageArguments.CODECS) not in ['DEFAULT', '']
 
 
 class ByeCommand(ICommand):
@@ -76,15 +167,48 @@ class ByeCommand(ICommand):
 
     def execute_as_sender(self, node, message: Message, target):
         try:
-            node.send_message_to_target(message, target)
+            self.send_message(node, message, target)
         except:
-            print('Erro ao conectar!')
+            connection_log.warning('Erro ao conectar a %s', target)
             self.success = False
+        node.close_connection(target)
 
     def execute_as_receiver(self, node, message: Message, target=None):
         origin = message.origin
-        node.neighbours.remove(origin)
-        print(f'Removendo vizinho da tabela {origin}')
+        # O vizinho pode ja ter sido removido pelo detector de falhas; saiu
+        # por vontade propria, entao os heartbeats nao devem procura-lo
+        node.remove_neighbour(origin)
+        node.failure_detector.forget(origin)
+        node.close_connection(origin)
+        node.forget_peer_codecs(origin)
+        neighbour_log.info('Removendo vizinho da tabela %s', origin)
+
+
+class DigestCommand(ICommand):
+    def __init__(self) -> None:
+        super().__init__()
+        self.command = 'DIGEST'
+
+    def execute_as_sender(self, node, message: Message, target):
+        try:
+            pending_send = self.send_message(node, message, target)
+        except OSError:
+            connection_log.warning('Erro ao enviar resumo de chaves para %s', target)
+            self.success = False
+            return
+        encoded_digest = message.get_argument_val(MessageArguments.DIGEST)
+        self.when_sent(pending_send, lambda: node.record_digest_sent(target, encoded_digest))
+
+    def execute_as_receiver(self, node, message: Message, target=None):
+        try:
+            digest = KeyDigest.decode(message.get_argument_val(MessageArguments.DIGEST))
+        except ValueError as exception:
+            neighbour_log.warning('Resumo de chaves de %s descartado: %s', message.origin, exception)
+            return
+        node.neighbour_digests[message.origin] = digest
+        node.metrics.increment('digests_received_total')
+        neighbour_log.debug('Resumo de chaves recebido de %s (%d niveis)',
+                            message.origin, len(digest.levels))
 
 
 class ValCommand(ICommand):
@@ -94,15 +218,102 @@ class ValCommand(ICommand):
         self.command = 'VAL'
 
     def execute_as_sender(self, node, message: Message, target=None):
-        node.send_message_to_target(message, target)
+        self.send_message(node, message, target)
 
     def execute_as_receiver(self, node, message: Message, target=None):
-        print('\tValor encontrado!')
         key = message.get_argument_val(MessageArguments.KEY)
         value = message.get_argument_val(MessageArguments.VALUE)
-        print(f'\t\tchave: {key} valor: {value}')
+        search_log.info('\tValor encontrado!\n\t\tchave: %s valor: %s', key, value)
+        node.result_cache.put(key, value)
         node.update_stats_mean(CommandMode[message.get_argument_val(MessageArguments.MODE)],
                                message.get_argument_val(MessageArguments.HOP_COUNT))
+        node.routing_table.record_success(node.origin, message.seq_number,
+                                          message.get_argument_val(MessageArguments.HOP_COUNT))
+        request = node.pending_searches.resolve(message)
+        if request is None:
+            return
+        node.metrics.observe('search_round_trip_seconds',
+                             request.latency, mode=request.mode.value)
+        if node.cancel_searches and request.mode in CANCELLABLE_MODES:
+            cancel_command = node.cancel_search(request)
+            self.pending_sends += cancel_command.pending_sends
+
+
+class RValCommand(ValCommand):
+    # A origem da mensagem e a da busca; cada no do caminho guarda uma replica
+    # do valor e o repassa ao vizinho de quem recebeu a busca
+    def __init__(self, mode) -> None:
+        super().__init__(mode)
+        self.command = 'RVAL'
+
+    def execute_as_sender(self, node, message: Message, target=None):
+        try:
+            self.send_message(node, message, target)
+        except OSError as exception:
+            connection_log.warning('Erro ao devolver o VAL para %s: %s', target, exception)
+            self.send_message(node, node.build_direct_reply(message), message.origin)
+
+    def execute_as_receiver(self, node, message: Message, target=None):
+        if message.origin == node.origin:
+            super().execute_as_receiver(node, message, target)
+            return
+        # Outro no ja devolveu o valor por aqui: a origem so precisa de um
+        if node.resolved_searches.check_and_add(message.origin, message.seq_number):
+            return
+        node.replica_cache.put(message.get_argument_val(MessageArguments.KEY),
+                               message.get_argument_val(MessageArguments.VALUE))
+        node.metrics.increment('vals_relayed_total')
+        node.routing_table.record_success(message.origin, message.seq_number,
+                                          message.get_argument_val(MessageArguments.HOP_COUNT))
+        previous_hop = node.reverse_paths.get(message.origin, message.seq_number)
+        new_message = Message(message.origin, message.seq_number, message.ttl - 1,
+                              message.operation, message.arguments)
+        if previous_hop not in node.peer_codecs or not new_message.ttl > 0:
+            search_log.debug('RVAL: caminho de volta desconhecido, enviando direto a origem')
+            self.send_message(node, node.build_direct_reply(message), message.origin)
+            return
+        self.execute_as_sender(node, new_message, previous_hop)
+
+
+class CancelCommand(ICommand):
+    # Marca origem:seqno como respondida, e quem tem a marca descarta novas
+    # copias da busca. O cancelamento nao e inundado: quem ja repassou a
+    # busca o manda no lugar das copias que a marca descartou na fila
+    # (NodeServer.get_cancel_in_place), entao ele segue a frente da busca.
+    def __init__(self, mode) -> None:
+        super().__init__()
+        self.mode = mode
+        self.command = 'CANCEL'
+
+    def execute_as_sender(self, node, message: Message, target=None):
+        node.resolved_searches.check_and_add(message.origin, message.seq_number)
+        targets = node.get_negotiated_neighbours()
+        if targets:
+            self.send_message_to_all(node, message, targets)
+
+    def execute_as_receiver(self, node, message: Message, target=None):
+        # A marca tambem deduplica: cada no aplica o cancelamento uma vez
+        if node.resolved_searches.check_and_add(message.origin, message.seq_number):
+            return
+        node.metrics.increment('cancels_received_total')
+
+
+class RingCommand(ICommand):
+    # Enviado a origem por um no em que o TTL de um anel ER acabou com
+    # vizinhos ainda por visitar: sem nenhum aviso, o proximo anel nao
+    # alcancaria nos novos
+    def __init__(self) -> None:
+        super().__init__()
+        self.command = 'RING'
+
+    def execute_as_sender(self, node, message: Message, target=None):
+        self.send_message(node, message, message.origin)
+
+    def execute_as_receiver(self, node, message: Message, target=None):
+        # Avisos de aneis anteriores nao acham mais a busca pelo seqno
+        request = node.pending_searches.get(message.seq_number)
+        if request is not None:
+            request.ring_truncated = True
 
 
 class SearchCommand(ICommand):
@@ -114,42 +325,65 @@ class SearchCommand(ICommand):
 
     def execute_as_sender(self, node, message: Message, target=None):
         search_key = message.get_argument_val(MessageArguments.KEY)
-        if search_key in node.key_value.keys():
-            print('\tChave encontrada!')
-            return node.key_value[search_key]
+        value = self.lookup_key(node, search_key)
+        if value is not None:
+            return value
         self.success = False
 
         if self.mode == CommandMode.FL.value:
-            for neighbour in node.neighbours:
-                node.send_message_to_target(message, neighbour)
+            self.send_message_to_all(node, message, node.select_by_digest(search_key, node.neighbours.copy()))
+            return
+
+        if self.mode == CommandMode.ER.value:
+            self.expanding_ring_search(node, message)
             return
 
         if self.mode == CommandMode.RW.value:
-            if not len(node.neighbours) - 1 >= 0:
+            node_neighbours = node.select_by_digest(search_key, node.neighbours.copy())
+            if not len(node_neighbours) - 1 >= 0:
+                return
+            self.send_to_next_hop(node, message, node_neighbours)
+            return
+
+        if self.mode == CommandMode.KW.value:
+            if not node.neighbours:
                 return
-            next_neighbour_index = random.randint(0, len(node.neighbours) - 1)
-            node.send_message_to_target(
-                message, node.neighbours[next_neighbour_index])
+            # k caminhantes com a mesma mensagem; vizinhos distintos quando possivel
+            if len(node.neighbours) >= node.walkers:
+                targets = random.sample(node.neighbours, node.walkers)
+            else:
+                targets = [random.choice(node.neighbours)
+                           for _ in range(node.walkers)]
+            self.send_message_to_all(node, message, targets)
             return
 
         if self.mode == CommandMode.BP.value:
-            bp_key = f"{message.origin}:{message.seq_number}"
-            node.bp_search_info[bp_key] = {}
-            node.bp_search_info[bp_key]['mother'] = node.origin
-            node.bp_search_info[bp_key]['neighbours'] = node.neighbours.copy()
-            if not len(node.neighbours) - 1 >= 0:
+            bp_key = self.get_bp_key(message)
+            state = node.bp_search_info.create(bp_key, node.origin)
+            node_neighbours = node.select_by_digest(
+                search_key, state.remaining_neighbours(node.neighbours))
+            if not len(node_neighbours) - 1 >= 0:
+                node.bp_search_info.remove(bp_key)
                 return
-            next_neighbour_index = random.randint(0, len(node.neighbours) - 1)
-            active_neighbour = node.neighbours[next_neighbour_index]
-            node.bp_search_info[bp_key]['neighbours'].remove(active_neighbour)
-            node.bp_search_info[bp_key]['active'] = active_neighbour
-            node.send_message_to_target(
-                message, active_neighbour)
+            self.send_to_next_hop(node, message, node_neighbours, on_choose=state.visit,
+                                  on_exhausted=lambda: node.bp_search_info.remove(bp_key))
             return
 
     def execute_as_receiver(self, node, message: Message, target=None):
+        if not node.searches_received.check_and_add(message.origin, message.seq_number):
+            node.record_search_path(message, self.get_sender(node, message))
+        if node.resolved_searches.contains(message.origin, message.seq_number):
+            # Busca ja respondida: descarta a copia em vez de repassa-la
+            self.success = False
+            node.metrics.increment('searches_cancelled_total', mode=self.mode)
+            return
+        value = self.dispatch_receiver_procedure(node, message)
+        if self.success:
+            node.resolved_searches.check_and_add(message.origin, message.seq_number)
+        return value
 
-        if self.mode == CommandMode.FL.value:
+    def dispatch_receiver_procedure(self, node, message: Message):
+        if self.mode in [CommandMode.FL.value, CommandMode.ER.value]:
             return self.fl_search_receiver_procedure(node, message)
 
         if self.mode == CommandMode.RW.value:
@@ -158,17 +392,70 @@ class SearchCommand(ICommand):
         if self.mode == CommandMode.BP.value:
             return self.bp_search_receiver_procedure(node, message)
 
+        if self.mode == CommandMode.KW.value:
+            return self.kw_search_receiver_procedure(node, message)
+
+    def expanding_ring_search(self, node, message: Message):
+        # Cada anel e uma nova inundacao com outro numero de sequencia, para
+        # que os nos que ja viram o anel anterior nao a descartem
+        request = node.pending_searches.get(message.seq_number)
+        if request is None:
+            request = node.pending_searches.register(
+                message.seq_number, message.get_argument_val(MessageArguments.KEY), CommandMode.ER)
+        ring_message = message
+        rings = 0
+        for ttl in self.get_ring_ttls(node.ring_max_ttl or message.ttl):
+            ring_wait = node.ring_hop_timeout * (ttl + 1)
+            remaining = request.remaining()
+            if remaining is not None:
+                if remaining <= 0:
+                    break
+                ring_wait = min(ring_wait, remaining)
+            rings += 1
+            if rings > 1:
+                ring_message = (node.message_builder
+                                .build_origin(message.origin)
+                                .build_operation(OperationType.SEARCH)
+                                .build_arguments(message.arguments.copy())
+                                .build_ttl(ttl)
+                                .get_message())
+                node.pending_searches.rekey(request, ring_message.seq_number)
+            ring_message.ttl = ttl
+            request.ring_truncated = False
+            search_log.info('ER: anel %d com TTL %d', rings, ttl)
+            self.send_message_to_all(node, ring_message, node.select_by_digest(
+                message.get_argument_val(MessageArguments.KEY), node.neighbours.copy()))
+            if request.wait(ring_wait):
+                break
+            if node.ring_reports and not request.ring_truncated:
+                # Nenhum no ficou sem repassar por falta de TTL: um anel maior
+                # so repetiria os mesmos nos
+                search_log.info('ER: anel %d ja cobriu a rede alcancavel', rings)
+                break
+        request.rings = rings
+        if request.timed_out:
+            search_log.info('ER: chave %s nao encontrada apos %d aneis',
+                            message.get_argument_val(MessageArguments.KEY), rings)
+            return
+        node.metrics.observe('search_rings', rings, mode=CommandMode.ER.value)
+
+    @classmethod
+    def get_ring_ttls(cls, max_ttl):
+        ttl = 1
+        while ttl < max_ttl:
+            yield ttl
+            ttl *= 2
+        yield max_ttl
+
     def fl_search_receiver_procedure(self, node, message):
-        node.increment_stats_counter(CommandMode.FL)
+        node.increment_stats_counter(CommandMode(self.mode))
         if self.validate_message_seen(node, message):
             self.success = False
             return
-        node.flooding_messages_seen[message.origin].append(
-            message.seq_number)
         search_key = message.get_argument_val(MessageArguments.KEY)
-        if search_key in node.key_value.keys():
-            print('\tChave encontrada!')
-            return node.key_value[search_key]
+        value = self.lookup_key(node, search_key)
+        if value is not None:
+            return value
         self.success = False
         node_neighbours = node.neighbours.copy()
         self.remove_last_hop_port(node_neighbours, message.get_argument_val(
@@ -177,129 +464,167 @@ class SearchCommand(ICommand):
             return
         new_message = self.get_updated_message(node, message)
         if not new_message.ttl > 0:
+            if self.mode == CommandMode.ER.value and node.ring_reports and message.origin != node.origin:
+                self.report_ring_edge(node, message)
             return
-        for neighbour in node_neighbours:
-            node.send_message_to_target(new_message, neighbour)
+        self.send_message_to_all(node, new_message, node.select_by_digest(search_key, node_neighbours))
         return
 
+    def report_ring_edge(self, node, message):
+        command = CommandFactory.create_command(CommandType.RING)
+        try:
+            command.execute_as_sender(node, message.forward(node.port, OperationType.RING, False))
+        except OSError as exception:
+            connection_log.warning('Erro ao avisar %s do fim do anel: %s', message.origin, exception)
+        self.pending_sends += command.pending_sends
+
     def rw_search_receiver_procedure(self, node, message):
         node.increment_stats_counter(CommandMode.RW)
         search_key = message.get_argument_val(MessageArguments.KEY)
-        if search_key in node.key_value.keys():
-            print('\tChave encontrada!')
-            return node.key_value[search_key]
+        value = self.lookup_key(node, search_key)
+        if value is not None:
+            return value
         self.success = False
         new_message = self.get_updated_message(node, message)
         if not new_message.ttl > 0:
             return
         node_neighbours = node.neighbours.copy()
         if len(node_neighbours) == 1:
-            node.send_message_to_target(new_message, node_neighbours[0])
+            self.send_message(node, new_message, node_neighbours[0])
             return
         self.remove_last_hop_port(node_neighbours, message.get_argument_val(
             MessageArguments.LAST_HOP_PORT
         ))
-        next_neighbour_index = random.randint(0, len(node_neighbours) - 1)
-        node.send_message_to_target(
-            new_message, node_neighbours[next_neighbour_index])
+        node_neighbours = node.select_by_digest(search_key, node_neighbours)
+        self.send_to_next_hop(node, new_message, node_neighbours)
+        return
+
+    def kw_search_receiver_procedure(self, node, message: Message):
+        node.increment_stats_counter(CommandMode.KW)
+        if message.origin == node.origin:
+            # Caminhante voltou a origem (verificacao periodica ou passo da
+            # caminhada): so continua se a busca ainda nao foi respondida
+            self.success = False
+            if not node.pending_searches.is_pending(message.seq_number):
+                search_log.debug('KW: busca ja respondida, encerrando caminhante')
+                return
+            # A volta nao conta como salto: so a ida a origem gasta TTL
+            self.send_message(node, message.forward(node.port, count_hop=False),
+                              self.get_sender(node, message))
+            return
+        search_key = message.get_argument_val(MessageArguments.KEY)
+        value = self.lookup_key(node, search_key)
+        if value is not None:
+            return value
+        self.success = False
+        new_message = self.get_updated_message(node, message)
+        if not new_message.ttl > 0:
+            return
+        check_interval = node.walker_check_interval
+        if check_interval and int(new_message.get_argument_val(MessageArguments.HOP_COUNT)) % check_interval == 0:
+            self.send_message(node, new_message, message.origin)
+            return
+        node_neighbours = node.neighbours.copy()
+        if len(node_neighbours) > 1:
+            self.remove_last_hop_port(node_neighbours, message.get_argument_val(
+                MessageArguments.LAST_HOP_PORT))
+        if not node_neighbours:
+            return
+        self.send_to_next_hop(node, new_message, node.select_by_digest(search_key, node_neighbours),
+                              self.choose_random_hop)
         return
 
     def bp_search_receiver_procedure(self, node, message: Message):
         node.increment_stats_counter(CommandMode.BP)
         search_key = message.get_argument_val(MessageArguments.KEY)
-        if search_key in node.key_value.keys():
-            print('\tChave encontrada!')
-            return node.key_value[search_key]
+        value = self.lookup_key(node, search_key)
+        if value is not None:
+            return value
         self.success = False
+        bp_key = self.get_bp_key(message)
         new_message = self.get_updated_message(node, message)
         if not new_message.ttl > 0:
+            node.bp_search_info.remove(bp_key)
             return
-        bp_key = f"{message.origin}:{message.seq_number}"
-        if bp_key not in node.bp_search_info.keys():
-            self.initialize_bp_receiver_dict(node, message, bp_key)
-
-        if self.has_bp_ended(node, message, bp_key):
-            print(
-                f"BP: Nao foi possivel localizar a chave {message.get_argument_val(MessageArguments.KEY)}")
+        state = node.bp_search_info.get(bp_key)
+        if state is None:
+            state = self.initialize_bp_receiver_state(node, message, bp_key)
+
+        if self.has_bp_ended(node, message, state):
+            search_log.info('BP: Nao foi possivel localizar a chave %s',
+                            message.get_argument_val(MessageArguments.KEY))
+            node.bp_search_info.remove(bp_key)
             return
 
-        if self.bp_is_cycle(node, message, bp_key):
-            print("BP: ciclo detectado, devolvendo a mensagem...")
-            sender = f"{node.address}:{message.get_argument_val(MessageArguments.LAST_HOP_PORT)}"
-            if sender in node.bp_search_info[bp_key]['neighbours']:
-                node.bp_search_info[bp_key]['neighbours'].remove(sender)
-            node.send_message_to_target(
-                new_message, f"{node.address}:{message.get_argument_val(MessageArguments.LAST_HOP_PORT)}")
+        if self.bp_is_cycle(node, message, state):
+            search_log.debug('BP: ciclo detectado, devolvendo a mensagem...')
+            sender = self.get_sender(node, message)
+            state.visited.add(sender)
+            self.send_message(node, new_message, sender)
             return
 
-        if self.bp_is_neighbours_empty(node, bp_key):
-            print("BP: nenhum vizinho encontrou a chave, retrocedendo...")
-            node.send_message_to_target(
-                new_message, node.bp_search_info[bp_key]['mother'])
+        node_neighbours = node.select_by_digest(
+            search_key, state.remaining_neighbours(node.neighbours))
+        if not node_neighbours:
+            search_log.debug('BP: nenhum vizinho encontrou a chave, retrocedendo...')
+            self.send_message(node, new_message, state.mother)
             return
 
-        next_active_index = random.randint(
-            0, len(node.bp_search_info[bp_key]['neighbours']) - 1)
-        active_neighbour = node.bp_search_info[bp_key]['neighbours'][next_active_index]
-        node.bp_search_info[bp_key]['neighbours'].remove(active_neighbour)
-        node.bp_search_info[bp_key]['active'] = active_neighbour
-        node.send_message_to_target(new_message, active_neighbour)
+        self.send_to_next_hop(node, new_message, node_neighbours, on_choose=state.visit,
+                              on_exhausted=lambda: self.bp_backtrack(node, new_message, state.mother))
         return
 
-    def has_bp_ended(self, node, message: Message, bp_key):
-        is_node_own_mother = node.bp_search_info[bp_key]['mother'] == node.origin
-        is_neighbours_empty = self.bp_is_neighbours_empty(
-            node, bp_key)
-        is_message_from_active = (node.bp_search_info[bp_key]['active']
-                                  == f"{node.address}:{message.get_argument_val(MessageArguments.LAST_HOP_PORT)}")
+    @classmethod
+    def bp_backtrack(cls, node, message: Message, mother):
+        search_log.debug('BP: nenhum vizinho alcancavel, retrocedendo...')
+        return node.send_message_to_target(message, mother)
+
+    @classmethod
+    def choose_random_hop(cls, message: Message, candidates):
+        return random.choice(candidates)
+
+    def has_bp_ended(self, node, message: Message, state):
+        is_node_own_mother = state.mother == node.origin
+        is_neighbours_empty = not state.remaining_neighbours(node.neighbours)
+        is_message_from_active = state.active == self.get_sender(node, message)
         return is_node_own_mother and is_neighbours_empty and is_message_from_active
 
-    def bp_is_cycle(self, node, message: Message, bp_key):
-        sender = f"{node.address}:{message.get_argument_val(MessageArguments.LAST_HOP_PORT)}"
-        active_node = node.bp_search_info[bp_key]['active']
-        return active_node not in ['', sender]
+    def bp_is_cycle(self, node, message: Message, state):
+        return state.active not in ['', self.get_sender(node, message)]
+
+    def initialize_bp_receiver_state(self, node, message, bp_key):
+        mother = self.get_sender(node, message)
+        return node.bp_search_info.create(bp_key, mother, [mother])
 
-    def bp_is_neighbours_empty(self, node, bp_key):
-        return len(node.bp_search_info[bp_key]['neighbours']) == 0
+    def get_bp_key(self, message: Message):
+        return f"{message.origin}:{message.seq_number}"
 
-    def initialize_bp_receiver_dict(self, node, message, bp_key):
-        node.bp_search_info[bp_key] = {}
-        node.bp_search_info[bp_key][
-            'mother'] = f"{node.address}:{message.get_argument_val(MessageArguments.LAST_HOP_PORT)}"
-        node.bp_search_info[bp_key]['neighbours'] = node.neighbours.copy()
-        node.bp_search_info[bp_key]['neighbours'].remove(
-            node.bp_search_info[bp_key]['mother'])
-        node.bp_search_info[bp_key]['active'] = ''
+    def get_sender(self, node, message: Message):
+        return f"{node.address}:{message.get_argument_val(MessageArguments.LAST_HOP_PORT)}"
 
-    def remove_last_hop_port(self, neighbours_list: list, last_hop_port):
+    @classmethod
+    def remove_last_hop_port(cls, neighbours_list: list, last_hop_port):
         for neighbour in neighbours_list:
             if neighbour.split(':')[1] == last_hop_port:
                 neighbours_list.remove(neighbour)
                 break
 
     def get_updated_message(self, node, old_message: Message, new_operation_type: OperationType = None):
-        new_message = copy.deepcopy(old_message)
-        new_message.set_argument_val(
-            MessageArguments.LAST_HOP_PORT, node.port)
-        new_message.set_argument_val(MessageArguments.HOP_COUNT,
-                                     str(int(new_message.get_argument_val(MessageArguments.HOP_COUNT)) + 1))
-        (node.message_builder
-         .build_origin(new_message.origin)
-         .build_ttl(new_message.ttl - 1)
-         .build_seq_number(new_message.seq_number)
-         .build_arguments(new_message.arguments))
-        if new_operation_type:
-            node.message_builder.build_operation(new_operation_type)
-        else:
-            node.message_builder.build_operation(
-                OperationType[new_message.operation])
-        new_message = node.message_builder.get_message(False)
-        return new_message
+        return old_message.forward(node.port, new_operation_type)
+
+    def lookup_key(self, node, search_key):
+        value = node.key_value.get(search_key)
+        if value is not None:
+            search_log.info('\tChave encontrada!')
+            return value
+        value = node.result_cache.get(search_key)
+        if value is not None:
+            search_log.info('\tChave encontrada no cache de resultados!')
+            return value
+        value = node.replica_cache.get(search_key)
+        if value is not None:
+            search_log.info('\tChave encontrada no cache de replicas!')
+        return value
 
     def validate_message_seen(self, node, message):
-        if message.origin in node.flooding_messages_seen.keys():
-            if message.seq_number in node.flooding_messages_seen[message.origin]:
-                return True
-            return False
-        node.flooding_messages_seen[message.origin] = []
-        return False
+        return node.flooding_messages_seen.check_and_add(message.origin, message.seq_number)
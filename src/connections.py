@@ -0,0 +1,126 @@
+import asyncio
+import select
+import socket
+import threading
+
+
+class ConnectionPool:
+    def __init__(self, timeout=None) -> None:
+        self.timeout = timeout
+        self.connections = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def send(self, target, data: bytes):
+        with self.__get_lock(target):
+            connection = self.connections.get(target)
+            if connection is not None and self.__is_stale(connection):
+                self.__discard(target)
+                connection = None
+            if connection is None:
+                self.__open(target).sendall(data)
+                return
+            try:
+                connection.sendall(data)
+            except OSError:
+                self.__discard(target)
+                self.__open(target).sendall(data)
+
+    def close(self, target):
+        with self.__get_lock(target):
+            self.__discard(target)
+
+    def close_all(self):
+        for target in list(self.connections.keys()):
+            self.close(target)
+
+    def __get_lock(self, target):
+        with self.lock:
+            if target not in self.locks:
+                self.locks[target] = threading.Lock()
+            return self.locks[target]
+
+    def __open(self, target):
+        address, port = target.split(':')
+        connection = socket.create_connection((address, int(port)),
+                                              timeout=self.timeout)
+        self.connections[target] = connection
+        return connection
+
+    def __discard(self, target):
+        connection = self.connections.pop(target, None)
+        if connection is not None:
+            connection.close()
+
+    @classmethod
+    def __is_stale(cls, connection: socket.socket):
+        # O receptor nunca escreve nessas conexoes: se ha algo para ler, o
+        # outro lado fechou (EOF) ou a conexao foi resetada.
+        readable, _, _ = select.select([connection], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return connection.recv(1, socket.MSG_PEEK) == b''
+        except OSError:
+            return True
+
+
+class AsyncConnectionPool:
+    def __init__(self, timeout=None) -> None:
+        self.timeout = timeout
+        self.connections = {}
+        self.locks = {}
+
+    async def send(self, target, data: bytes):
+        lock = self.locks.setdefault(target, asyncio.Lock())
+        async with lock:
+            connection = self.connections.get(target)
+            if connection is not None and self.__is_stale(*connection):
+                await self.__discard(target)
+                connection = None
+            if connection is None:
+                await self.__write(await self.__open(target), data)
+                return
+            try:
+                await self.__write(connection, data)
+            except OSError:
+                await self.__discard(target)
+                await self.__write(await self.__open(target), data)
+
+    async def close(self, target):
+        lock = self.locks.setdefault(target, asyncio.Lock())
+        async with lock:
+            await self.__discard(target)
+
+    async def close_all(self):
+        for target in list(self.connections.keys()):
+            await self.close(target)
+
+    async def __open(self, target):
+        address, port = target.split(':')
+        # Um vizinho inalcancavel nao pode segurar o envio pelo timeout do SO
+        connection = await asyncio.wait_for(asyncio.open_connection(address, int(port)),
+                                            self.timeout)
+        self.connections[target] = connection
+        return connection
+
+    @classmethod
+    async def __write(cls, connection, data: bytes):
+        _, writer = connection
+        writer.write(data)
+        await writer.drain()
+
+    async def __discard(self, target):
+        connection = self.connections.pop(target, None)
+        if connection is None:
+            return
+        _, writer = connection
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    @classmethod
+    def __is_stale(cls, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        return writer.is_closing() or reader.at_eof()
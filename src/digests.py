@@ -0,0 +1,78 @@
+import base64
+import hashlib
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def get_positions(key, bits, hash_count):
+    # Hash duplo: as k posicoes saem de dois hashes de 64 bits da chave
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    first = int.from_bytes(digest[:8], 'big')
+    second = int.from_bytes(digest[8:], 'big') | 1
+    return tuple((first + index * second) % bits for index in range(hash_count))
+
+
+class BloomFilter:
+    __slots__ = ('bits', 'hash_count', 'data')
+
+    def __init__(self, bits, hash_count, data: bytes = None) -> None:
+        self.bits = bits
+        self.hash_count = hash_count
+        self.data = bytearray(data) if data is not None else bytearray(bits // 8)
+
+    def add(self, key):
+        for position in get_positions(key, self.bits, self.hash_count):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def might_contain(self, key):
+        data = self.data
+        return all(data[position >> 3] & (1 << (position & 7))
+                   for position in get_positions(key, self.bits, self.hash_count))
+
+    def update(self, other):
+        self.data = bytearray((int.from_bytes(self.data, 'big') | int.from_bytes(other.data, 'big'))
+                              .to_bytes(len(self.data), 'big'))
+
+
+class KeyDigest:
+    # Filtro de Bloom atenuado: o nivel 0 resume as chaves do proprio no e o
+    # nivel i as chaves a i saltos dele, pela uniao dos niveis i - 1 dos
+    # vizinhos. Todos os niveis tem o mesmo tamanho para que a uniao funcione.
+    def __init__(self, levels) -> None:
+        self.levels = levels
+
+    @classmethod
+    def build(cls, keys, neighbour_digests, depth=2, bits=16384, hash_count=4):
+        levels = [BloomFilter(bits, hash_count) for _ in range(depth)]
+        for key in keys:
+            levels[0].add(key)
+        for digest in neighbour_digests:
+            for level, neighbour_level in zip(levels[1:], digest.levels):
+                if neighbour_level.bits == bits and neighbour_level.hash_count == hash_count:
+                    level.update(neighbour_level)
+        return cls(levels)
+
+    def match_level(self, key):
+        # Primeiro nivel que pode conter a chave, ou None
+        for index, level in enumerate(self.levels):
+            if level.might_contain(key):
+                return index
+        return None
+
+    def encode(self):
+        # numero de hashes:bits por nivel:niveis concatenados em base64
+        first = self.levels[0]
+        data = b''.join(bytes(level.data) for level in self.levels)
+        return f'{first.hash_count}:{first.bits}:{base64.b64encode(data).decode()}'
+
+    @classmethod
+    def decode(cls, text):
+        hash_count, bits, data = text.split(':')
+        hash_count, bits = int(hash_count), int(bits)
+        data = base64.b64decode(data, validate=True)
+        level_size = bits // 8
+        if not hash_count > 0 or not level_size > 0 or not data or len(data) % level_size:
+            raise ValueError(f'resumo de chaves invalido: {hash_count} hashes, {bits} bits, '
+                             f'{len(data)} bytes')
+        return cls([BloomFilter(bits, hash_count, data[offset:offset + level_size])
+                    for offset in range(0, len(data), level_size)])
@@ -0,0 +1,64 @@
+import threading
+from enum import Enum
+
+
+class PeerState(Enum):
+    UP = 'up'
+    SUSPECT = 'suspect'
+    DOWN = 'down'
+
+
+class FailureDetector:
+    # Conta os envios que falharam seguidos para cada vizinho: a primeira
+    # falha o torna suspeito e `down_after` falhas o derrubam. Qualquer envio
+    # bem-sucedido o traz de volta.
+    def __init__(self, down_after=3) -> None:
+        self.down_after = down_after
+        # vizinho -> falhas consecutivas
+        self.failures = {}
+        self.down = set()
+        self.lock = threading.Lock()
+
+    def record_failure(self, peer):
+        # Devolve True quando o vizinho acabou de cair
+        with self.lock:
+            failures = self.failures.get(peer, 0) + 1
+            self.failures[peer] = failures
+            if failures < self.down_after or peer in self.down:
+                return False
+            self.down.add(peer)
+            return True
+
+    def record_success(self, peer):
+        # Devolve True quando o vizinho estava fora do ar
+        with self.lock:
+            if peer not in self.failures:
+                return False
+            del self.failures[peer]
+            if peer not in self.down:
+                return False
+            self.down.discard(peer)
+            return True
+
+    def forget(self, peer):
+        with self.lock:
+            self.failures.pop(peer, None)
+            self.down.discard(peer)
+
+    def get_state(self, peer):
+        with self.lock:
+            if peer in self.down:
+                return PeerState.DOWN
+            if peer in self.failures:
+                return PeerState.SUSPECT
+            return PeerState.UP
+
+    def get_down_peers(self):
+        with self.lock:
+            return list(self.down)
+
+    def count(self, state: PeerState):
+        with self.lock:
+            if state == PeerState.DOWN:
+                return len(self.down)
+            return len(self.failures) - len(self.down)
@@ -0,0 +1,64 @@
+import struct
+from enum import Enum
+
+
+class FramingType(Enum):
+    QUOTED = 'quoted'
+    LENGTH = 'length'
+
+
+class FrameEncoder:
+    HEADER = struct.Struct('!I')
+
+    @classmethod
+    def encode(cls, payload: bytes, framing_type: FramingType):
+        if framing_type == FramingType.LENGTH:
+            return cls.HEADER.pack(len(payload)) + payload
+        return payload
+
+
+class FrameReader:
+    # Frames de texto comecam com aspas; os demais comecam com o tamanho em
+    # 4 bytes big-endian. O limite garante que o primeiro byte do cabecalho
+    # nunca seja confundido com aspas.
+    MAX_FRAME_SIZE = 16 * 1024 * 1024
+    QUOTE = ord('"')
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes):
+        self.buffer += data
+        frames = []
+        while self.buffer:
+            frame = self.__read_frame()
+            if frame is None:
+                break
+            frames.append(frame)
+        return frames
+
+    def __read_frame(self):
+        if self.buffer[0] == self.QUOTE:
+            end = self.buffer.find(b'"', 1)
+            if end < 0:
+                return None
+            frame = bytes(self.buffer[:end + 1])
+            del self.buffer[:end + 1]
+            return frame
+        header_size = FrameEncoder.HEADER.size
+        if len(self.buffer) < header_size:
+            return None
+        (length,) = FrameEncoder.HEADER.unpack_from(self.buffer)
+        if length > self.MAX_FRAME_SIZE:
+            raise FrameTooLargeException(length)
+        if len(self.buffer) < header_size + length:
+            return None
+        frame = bytes(self.buffer[header_size:header_size + length])
+        del self.buffer[:header_size + length]
+        return frame
+
+
+class FrameTooLargeException(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+        self.message = 'Frame size exceeds FrameReader.MAX_FRAME_SIZE'
@@ -0,0 +1,239 @@
+import asyncio
+import multiprocessing
+import os
+import random
+import signal
+import threading
+from src.async_node import AsyncNodeServer, run_background_tasks
+from src.messages import MessageBuilder
+from src.metrics import MetricsRegistry
+from src.logs import NodeLogging, get_logger
+
+connection_log = get_logger('connections')
+
+
+class HostManifest:
+    # Uma linha por no com os mesmos argumentos do main.py:
+    # endereco:porta arquivo_de_vizinhos [arquivo_chave_valor]
+    # Caminhos relativos partem do diretorio do manifesto; linhas vazias e
+    # iniciadas por # sao ignoradas.
+    FILE_NAME = 'manifest.txt'
+
+    @classmethod
+    def read(cls, path):
+        # -> [(origem, [vizinhos], arquivo chave valor ou '')]
+        directory = os.path.dirname(os.path.abspath(path))
+        entries = []
+        origins = set()
+        with open(path, 'r') as file:
+            for line_number, line in enumerate(file, 1):
+                fields = line.split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                if len(fields) not in [2, 3] or ':' not in fields[0]:
+                    raise ValueError(f'{path}:{line_number}: esperado endereco:porta arquivo_de_vizinhos '
+                                     f'[arquivo_chave_valor]')
+                origin = fields[0]
+                if origin in origins:
+                    raise ValueError(f'{path}:{line_number}: no {origin} repetido')
+                origins.add(origin)
+                with open(os.path.join(directory, fields[1]), 'r') as neighbours_file:
+                    neighbours = [x.strip() for x in neighbours_file.readlines() if x.strip()]
+                key_value = os.path.join(directory, fields[2]) if len(fields) == 3 else ''
+                entries.append((origin, neighbours, key_value))
+        return entries
+
+    @classmethod
+    def write(cls, directory, adjacency, address='127.0.0.1', base_port=20000, keys=0, seed=None):
+        # Gera o manifesto de uma Topology, com um arquivo de vizinhos por no
+        # e `keys` chaves distribuidas ao acaso, como Simulation.place_keys
+        os.makedirs(directory, exist_ok=True)
+        origins = [f'{address}:{base_port + index}' for index in range(len(adjacency))]
+        generator = random.Random(seed)
+        node_keys = [[] for _ in adjacency]
+        for key_index in range(keys):
+            node_keys[generator.randrange(len(adjacency))].append(key_index)
+        lines = []
+        for index, neighbours in enumerate(adjacency):
+            neighbours_file = f'vizinhos{index}.txt'
+            with open(os.path.join(directory, neighbours_file), 'w') as file:
+                file.writelines(f'{origins[x]}\n' for x in sorted(neighbours))
+            line = f'{origins[index]} {neighbours_file}'
+            if node_keys[index]:
+                key_value_file = f'chaves{index}.txt'
+                with open(os.path.join(directory, key_value_file), 'w') as file:
+                    file.writelines(f'chave{x} valor{x}\n' for x in node_keys[index])
+                line += f' {key_value_file}'
+            lines.append(line + '\n')
+        path = os.path.join(directory, cls.FILE_NAME)
+        with open(path, 'w') as file:
+            file.writelines(lines)
+        return path
+
+
+def run_shard(entries, node_options, log_queue, log_options, connection, barrier):
+    # Ponto de entrada de cada processo do host; o Ctrl+C e tratado pelo
+    # processo principal, que pede o encerramento pela conexao
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    NodeLogging.configure_shard(log_queue, **log_options)
+    HostShard(entries, node_options, connection, barrier).run()
+
+
+class HostShard:
+    # Os nos de um processo do host, todos no mesmo event loop. Cada no
+    # sobe sem vizinhos; os HELLOs so saem depois que os nos de todos os
+    # processos aceitam conexoes, senao metade deles seria recusada.
+    def __init__(self, entries, node_options, connection, barrier) -> None:
+        self.entries = entries
+        self.node_options = node_options
+        self.connection = connection
+        self.barrier = barrier
+        self.nodes = []
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        tasks = []
+        try:
+            for origin, _, key_value in self.entries:
+                address, port = origin.rsplit(':', 1)
+                node = AsyncNodeServer(address, port, [], key_value, True, MessageBuilder(),
+                                       **self.node_options)
+                node.shared_background_tasks = True
+                self.nodes.append(node)
+            tasks = [asyncio.create_task(node.serve()) for node in self.nodes]
+            await self.__wait_listening(tasks)
+            await asyncio.to_thread(self.barrier.wait)
+            await asyncio.gather(*[asyncio.to_thread(node.initialize_neighbours, neighbours)
+                                   for node, (_, neighbours, _) in zip(self.nodes, self.entries)])
+            tasks.append(asyncio.create_task(run_background_tasks(self.nodes)))
+            self.connection.send(('ready', len(self.nodes),
+                                  sum(len(x.bootstrap_report['added']) for x in self.nodes),
+                                  sum(len(x.bootstrap_report['rejected']) for x in self.nodes)))
+            await asyncio.to_thread(self.__answer_requests)
+        except (OSError, threading.BrokenBarrierError) as exception:
+            self.barrier.abort()
+            self.connection.send(('error', str(exception) or 'outro processo do host falhou'))
+        finally:
+            for node in self.nodes:
+                node.should_run_flag = False
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __wait_listening(self, tasks):
+        while not all(node.listening.is_set() for node in self.nodes):
+            for node, task in zip(self.nodes, tasks):
+                # serve so termina antes de escutar se nao conseguiu a porta
+                if task.done():
+                    raise OSError(f'{node.origin}: {task.exception()}')
+            await asyncio.sleep(0.1)
+
+    def __answer_requests(self):
+        while True:
+            try:
+                request = self.connection.recv()
+            except EOFError:
+                return
+            if request == 'stop':
+                return
+            if request == 'metrics':
+                values = []
+                for node in self.nodes:
+                    values.extend(node.metrics.collect((('node', node.origin),)))
+                definitions = self.nodes[0].metrics.definitions if self.nodes else {}
+                self.connection.send(('metrics', definitions, values))
+
+
+class NodeHost:
+    # Divide os nos do manifesto em `processes` processos (um por nucleo, por
+    # padrao). O log de todos sai pela fila do processo principal, e export
+    # junta as metricas de todos os nos, com o rotulo node, para o
+    # MetricsExporter.
+    QUEUE_SIZE = 10000
+
+    def __init__(self, entries, processes=None, node_options=None, log_options=None) -> None:
+        self.entries = entries
+        self.processes = max(1, min(processes or os.cpu_count() or 1, len(entries)))
+        self.node_options = node_options or {}
+        self.log_options = log_options or {}
+        self.context = multiprocessing.get_context('spawn')
+        self.log_queue = self.context.Queue(self.QUEUE_SIZE)
+        self.workers = []
+        self.connections = []
+        # Uma requisicao por vez em cada conexao
+        self.lock = threading.Lock()
+
+    def start(self):
+        # Devolve (nos, vizinhos adicionados, vizinhos que nao responderam)
+        # quando todos os processos terminaram o bootstrap
+        barrier = self.context.Barrier(self.processes)
+        for shard_entries in self.__split_entries():
+            connection, shard_connection = self.context.Pipe()
+            worker = self.context.Process(target=run_shard, daemon=True,
+                                          args=(shard_entries, self.node_options, self.log_queue,
+                                                self.log_options, shard_connection, barrier))
+            worker.start()
+            # Sem a copia do processo principal, o recv ve EOFError se o filho morrer
+            shard_connection.close()
+            self.workers.append(worker)
+            self.connections.append(connection)
+        totals = [0, 0, 0]
+        errors = []
+        for connection in self.connections:
+            try:
+                reply = connection.recv()
+            except EOFError:
+                errors.append('processo do host encerrado durante o bootstrap')
+                continue
+            if reply[0] == 'error':
+                errors.append(reply[1])
+                continue
+            totals = [total + value for total, value in zip(totals, reply[1:])]
+        if errors:
+            self.stop()
+            raise RuntimeError('; '.join(dict.fromkeys(errors)))
+        return tuple(totals)
+
+    def export(self):
+        definitions = {}
+        values = []
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.send('metrics')
+                    _, shard_definitions, shard_values = connection.recv()
+                except (EOFError, OSError) as exception:
+                    connection_log.warning('Metricas de um processo do host indisponiveis: %s', exception)
+                    continue
+                definitions.update(shard_definitions)
+                values.extend(shard_values)
+        return MetricsRegistry.format_values(definitions, values)
+
+    def is_alive(self):
+        return all(worker.is_alive() for worker in self.workers)
+
+    def stop(self, timeout=10):
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.send('stop')
+                except OSError:
+                    pass
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        for connection in self.connections:
+            connection.close()
+        self.workers = []
+        self.connections = []
+
+    def __split_entries(self):
+        # Faixas continuas do manifesto: em anel e grade, vizinhos tem portas
+        # proximas e costumam ficar no mesmo processo
+        size, remainder = divmod(len(self.entries), self.processes)
+        start = 0
+        for index in range(self.processes):
+            end = start + size + (1 if index < remainder else 0)
+            yield self.entries[start:end]
+            start = end
@@ -0,0 +1,165 @@
+import contextvars
+import itertools
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+LOGGER_NAME = 'node'
+# messages: cada mensagem recebida e enviada (DEBUG)
+# search: andamento das buscas; neighbours: tabela de vizinhos
+# connections: falhas de conexao e envio
+CATEGORIES = ['messages', 'search', 'neighbours', 'connections']
+LEVELS = ['debug', 'info', 'warning', 'error']
+# Origem do no que esta registrando, para quando varios nos dividem um
+# processo (host.py); cada thread e cada tarefa asyncio tem o seu valor
+current_node = contextvars.ContextVar('current_node', default='-')
+
+
+def get_logger(category):
+    return logging.getLogger(f'{LOGGER_NAME}.{category}')
+
+
+class SamplingFilter(logging.Filter):
+    # Deixa passar um a cada `every` registros da categoria
+    def __init__(self, every) -> None:
+        super().__init__()
+        self.every = every
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        return next(self.counter) % self.every == 0
+
+
+class RateLimitFilter(logging.Filter):
+    # Balde de fichas: no maximo `rate` registros por segundo, com rajadas
+    # do mesmo tamanho
+    def __init__(self, rate) -> None:
+        super().__init__()
+        self.rate = rate
+        self.tokens = rate
+        self.updated_at = time.monotonic()
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens +
+                              (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens < 1:
+                self.suppressed += 1
+                return False
+            self.tokens -= 1
+            return True
+
+
+class NodeContextFilter(logging.Filter):
+    # Roda na thread que registrou, onde current_node ainda vale
+    def filter(self, record):
+        record.node = current_node.get()
+        return True
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    # O QueueHandler padrao formata a mensagem na thread que registrou; aqui a
+    # formatacao fica para a thread do QueueListener. Com a fila cheia o
+    # registro e descartado em vez de bloquear quem esta encaminhando mensagens.
+    # Registros que vao para outro processo precisam ser formatados antes,
+    # porque os argumentos nem sempre podem ser serializados.
+    def __init__(self, log_queue, defer_formatting=True) -> None:
+        super().__init__(log_queue)
+        self.defer_formatting = defer_formatting
+        self.dropped = 0
+
+    def prepare(self, record):
+        if self.defer_formatting:
+            return record
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class NodeLogging:
+    handler = None
+    listener = None
+    filters = []
+
+    @classmethod
+    def configure(cls, level='info', quiet=False, sampling=None, rate_limits=None,
+                  stream=None, queue_size=10000, log_queue=None):
+        # log_queue: multiprocessing.Queue pela qual outros processos
+        # (configure_shard) tambem enviam seus registros para esta saida
+        cls.stop()
+        output_handler = logging.StreamHandler(stream or sys.stdout)
+        output_handler.setFormatter(logging.Formatter('%(message)s'))
+        if log_queue is None:
+            cls.handler = BackgroundQueueHandler(queue.Queue(queue_size))
+        else:
+            cls.handler = BackgroundQueueHandler(log_queue, defer_formatting=False)
+        cls.__configure_logger(level, quiet, sampling, rate_limits)
+        cls.listener = logging.handlers.QueueListener(
+            cls.handler.queue, output_handler)
+        cls.listener.start()
+
+    @classmethod
+    def configure_shard(cls, log_queue, level='info', quiet=False, sampling=None, rate_limits=None):
+        # Processo com varios nos: cada registro e formatado aqui, com a
+        # origem do no, e escrito pelo processo que chamou configure
+        cls.handler = BackgroundQueueHandler(log_queue, defer_formatting=False)
+        cls.handler.setFormatter(logging.Formatter('%(node)s %(message)s'))
+        cls.handler.addFilter(NodeContextFilter())
+        cls.__configure_logger(level, quiet, sampling, rate_limits)
+
+    @classmethod
+    def stop(cls):
+        if cls.listener is None:
+            return
+        cls.listener.stop()
+        logging.getLogger(LOGGER_NAME).removeHandler(cls.handler)
+        for category, log_filter in cls.filters:
+            get_logger(category).removeFilter(log_filter)
+        suppressed = sum(x.suppressed for _, x in cls.filters
+                         if isinstance(x, RateLimitFilter))
+        if cls.handler.dropped or suppressed:
+            print(f'Registros de log descartados: {cls.handler.dropped} com a fila cheia, '
+                  f'{suppressed} pelo limite de taxa', file=sys.stderr)
+        cls.handler = None
+        cls.listener = None
+        cls.filters = []
+
+    @classmethod
+    def parse_category_values(cls, values, value_type):
+        # ['messages=100', 'search=10'] -> {'messages': 100, 'search': 10}
+        parsed = {}
+        for value in values or []:
+            category, _, number = value.partition('=')
+            if category not in CATEGORIES or not number:
+                raise ValueError(f'esperado categoria=valor com categoria em {", ".join(CATEGORIES)}: '
+                                 f'{value}')
+            parsed[category] = value_type(number)
+        return parsed
+
+    @classmethod
+    def __configure_logger(cls, level, quiet, sampling, rate_limits):
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.setLevel(logging.ERROR if quiet else getattr(
+            logging, level.upper()))
+        logger.propagate = False
+        logger.addHandler(cls.handler)
+        for category, every in (sampling or {}).items():
+            cls.__add_filter(category, SamplingFilter(every))
+        for category, rate in (rate_limits or {}).items():
+            cls.__add_filter(category, RateLimitFilter(rate))
+
+    @classmethod
+    def __add_filter(cls, category, log_filter):
+        get_logger(category).addFilter(log_filter)
+        cls.filters.append((category, log_filter))
@@ -1,3 +1,4 @@
+import threading
 from enum import Enum
 
 
@@ -6,6 +7,13 @@ class OperationType(Enum):
     SEARCH = "SEARCH"
     VAL = "VAL"
     BYE = "BYE"
+    # Novas operacoes entram no fim: o codec binario usa a posicao como codigo
+    CANCEL = "CANCEL"
+    # VAL devolvido salto a salto pelo caminho reverso da busca
+    RVAL = "RVAL"
+    DIGEST = "DIGEST"
+    # Aviso a origem de uma busca ER de que o TTL do anel acabou antes da rede
+    RING = "RING"
 
 
 class MessageArguments(Enum):
@@ -14,6 +22,13 @@ class MessageArguments(Enum):
     KEY = 'KEY'
     HOP_COUNT = 'HOP_COUNT'
     VALUE = 'VALUE'
+    CODECS = 'CODECS'
+    DIGEST = 'DIGEST'
+
+
+LAST_HOP_PORT = MessageArguments.LAST_HOP_PORT.value
+HOP_COUNT = MessageArguments.HOP_COUNT.value
+VAL_OPERATIONS = [OperationType.VAL.value, OperationType.RVAL.value]
 
 
 class MessageDecoder:
@@ -36,20 +51,35 @@ class MessageBuilder:
     def __init__(self) -> None:
         self.seq_number = 1
         self.ttl = 100
-        self.__initialize_new_message()
+        self.seq_lock = threading.Lock()
+        # Cada thread monta sua propria mensagem; so o contador de sequencia
+        # e compartilhado.
+        self.local = threading.local()
         pass
 
+    @property
+    def current_message(self):
+        try:
+            return self.local.message
+        except AttributeError:
+            return self.__initialize_new_message()
+
     def __initialize_new_message(self):
-        self.current_message = UnfinishedMessage(
-            seq_number=self.seq_number, ttl=self.ttl)
+        self.local.message = UnfinishedMessage(seq_number=None, ttl=None)
+        return self.local.message
 
     def set_ttl(self, ttl):
-        self.ttl = ttl
-        self.build_ttl(ttl)
+        self.ttl = int(ttl)
 
     def restart_seq_count(self):
-        self.seq_number = 1
-        self.build_seq_number(self.seq_number)
+        with self.seq_lock:
+            self.seq_number = 1
+
+    def next_seq_number(self):
+        with self.seq_lock:
+            seq_number = self.seq_number
+            self.seq_number += 1
+            return seq_number
 
     def build_ttl(self, ttl):
         self.current_message.ttl = int(ttl)
@@ -77,35 +107,74 @@ class MessageBuilder:
         if len(arguments) != 4:
             print("Arguments list may have more/less arguments than needed")
             return self
-        if not is_val_message:
-            self.current_message.arguments = {
+        self.current_message.arguments = self.map_arguments(
+            self.current_message.operation, arguments, is_val_message)
+        return self
+
+    @classmethod
+    def map_arguments(cls, operation, arguments: list, is_val_message=0):
+        if operation == OperationType.HELLO.value:
+            return {
                 MessageArguments.MODE.value: arguments[0],
-                MessageArguments.LAST_HOP_PORT.value: arguments[1],
-                MessageArguments.KEY.value: arguments[2],
+                MessageArguments.CODECS.value: arguments[1],
+                MessageArguments.LAST_HOP_PORT.value: arguments[2],
                 MessageArguments.HOP_COUNT.value: arguments[3]
             }
-        else:
-            self.current_message.arguments = {
+        if operation == OperationType.DIGEST.value:
+            return {
                 MessageArguments.MODE.value: arguments[0],
-                MessageArguments.KEY.value: arguments[1],
-                MessageArguments.VALUE.value: arguments[2],
+                MessageArguments.DIGEST.value: arguments[1],
+                MessageArguments.LAST_HOP_PORT.value: arguments[2],
                 MessageArguments.HOP_COUNT.value: arguments[3]
             }
-        return self
+        if not is_val_message:
+            return {
+                MessageArguments.MODE.value: arguments[0],
+                MessageArguments.LAST_HOP_PORT.value: arguments[1],
+                MessageArguments.KEY.value: arguments[2],
+                MessageArguments.HOP_COUNT.value: arguments[3]
+            }
+        return {
+            MessageArguments.MODE.value: arguments[0],
+            MessageArguments.KEY.value: arguments[1],
+            MessageArguments.VALUE.value: arguments[2],
+            MessageArguments.HOP_COUNT.value: arguments[3]
+        }
+
+    @classmethod
+    def build_received_message(cls, decoded_message: dict):
+        # Monta a mensagem recebida sem passar pelo estado do builder
+        operation = OperationType[decoded_message['OPERATION']].value
+        arguments = decoded_message['ARGUMENTS']
+        if not isinstance(arguments, dict):
+            if len(arguments) != 4:
+                raise UnfinishedMessageException()
+            arguments = cls.map_arguments(
+                operation, arguments, operation in VAL_OPERATIONS)
+        return Message(decoded_message['ORIGIN'], int(decoded_message['SEQNO']),
+                       int(decoded_message['TTL']), operation, arguments)
 
     def get_message(self, increment_seq_number=True):
-        if not self.current_message.check_for_finished():
-            raise UnfinishedMessageException()
         current_message = self.current_message
-        returned_message = Message(current_message.origin, current_message.seq_number,
-                                   current_message.ttl, current_message.operation,
-                                   current_message.arguments)
+        if not current_message.check_for_finished():
+            raise UnfinishedMessageException()
+        seq_number = current_message.seq_number
+        if increment_seq_number:
+            allocated_seq_number = self.next_seq_number()
+            if seq_number is None:
+                seq_number = allocated_seq_number
+        elif seq_number is None:
+            seq_number = self.seq_number
+        ttl = current_message.ttl if current_message.ttl is not None else self.ttl
+        returned_message = Message(current_message.origin, seq_number, ttl,
+                                   current_message.operation, current_message.arguments)
         self.__initialize_new_message()
-        self.seq_number += increment_seq_number
         return returned_message
 
 
 class Message:
+    __slots__ = ('origin', 'seq_number', 'ttl', 'operation', 'arguments')
+
     def __init__(self, origin, seq_number, ttl, operation, arguments: dict) -> None:
         self.origin = origin
         self.seq_number = seq_number
@@ -114,21 +183,34 @@ class Message:
         self.arguments = arguments
 
     def get_argument_val(self, argument_key: MessageArguments):
-        if argument_key.value in self.arguments.keys():
-            return self.arguments[argument_key.value]
-        return "DEFAULT"
+        return self.arguments.get(argument_key.value, "DEFAULT")
 
     def set_argument_val(self, argument_key: MessageArguments, val):
-        if argument_key.value in self.arguments.keys():
+        if argument_key.value in self.arguments:
             self.arguments[argument_key.value] = val
 
+    def forward(self, last_hop_port, operation_type: OperationType = None, count_hop=True):
+        # Copia rasa: so TTL, LAST_HOP_PORT e HOP_COUNT mudam a cada salto
+        arguments = self.arguments.copy()
+        if LAST_HOP_PORT in arguments:
+            arguments[LAST_HOP_PORT] = last_hop_port
+        if HOP_COUNT in arguments and count_hop:
+            arguments[HOP_COUNT] = str(int(arguments[HOP_COUNT]) + 1)
+        operation = operation_type.value if operation_type else self.operation
+        ttl = self.ttl - 1 if count_hop else self.ttl
+        return Message(self.origin, self.seq_number, ttl, operation, arguments)
+
     def __str__(self) -> str:
-        if len(self.arguments) > 0 and self.get_argument_val(MessageArguments.MODE) != 'DEFAULT':
+        if len(self.arguments) > 0 and (self.get_argument_val(MessageArguments.MODE) != 'DEFAULT'
+                                        or self.get_argument_val(MessageArguments.CODECS) not in ['DEFAULT', '']
+                                        or self.operation == OperationType.DIGEST.value):
             return f'"{self.origin} {str(self.seq_number)} {str(self.ttl)} {self.operation} {" ".join([str(x) for x in self.arguments.values()])}"'
         return f'"{self.origin} {str(self.seq_number)} {str(self.ttl)} {self.operation}"'
 
 
 class UnfinishedMessage(Message):
+    __slots__ = ()
+
     def __init__(self, seq_number, ttl) -> None:
         super().__init__('', seq_number, ttl, '', '')
 
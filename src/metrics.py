@@ -0,0 +1,202 @@
+import bisect
+import http.server
+import os
+import threading
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets) -> None:
+        self.buckets = buckets
+        # counts[i]: observacoes em (buckets[i - 1], buckets[i]]; a ultima
+        # posicao guarda as maiores que o ultimo limite
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0
+
+    def cumulative_counts(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                       0.25, 0.5, 1, 2.5, 5, 10)
+    HOP_BUCKETS = (1, 2, 3, 4, 5, 7, 10, 15, 20, 30, 50, 100)
+    PREFIX = 'node_'
+
+    def __init__(self) -> None:
+        # nome -> (tipo, descricao, limites dos histogramas)
+        self.definitions = {}
+        # (nome, rotulos) -> valor ou Histogram
+        self.values = {}
+        # nome -> funcao que devolve o valor na hora da exportacao
+        self.callbacks = {}
+        self.lock = threading.Lock()
+
+    def define_counter(self, name, description, callback=None):
+        self.definitions[name] = ('counter', description, None)
+        if callback is not None:
+            self.callbacks[name] = callback
+
+    def define_gauge(self, name, description, callback=None):
+        self.definitions[name] = ('gauge', description, None)
+        if callback is not None:
+            self.callbacks[name] = callback
+
+    def define_histogram(self, name, description, buckets=LATENCY_BUCKETS):
+        self.definitions[name] = ('histogram', description, tuple(buckets))
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = Histogram(self.definitions[name][2])
+                self.values[key] = histogram
+            histogram.observe(value)
+
+    def get(self, name, **labels):
+        # Histogramas devolvem (numero de observacoes, media)
+        with self.lock:
+            value = self.values.get((name, tuple(sorted(labels.items()))))
+            if self.definitions[name][0] == 'histogram':
+                return (value.count, value.mean) if value is not None else (0, 0)
+            return value or 0
+
+    def collect(self, extra_labels=()):
+        # Copia dos valores como (nome, rotulos, valor); extra_labels vem
+        # antes dos rotulos de cada valor, para juntar varios registros
+        with self.lock:
+            values = sorted(((name, labels, self.__copy(value))
+                             for (name, labels), value in self.values.items()),
+                            key=lambda x: (x[0], x[1]))
+        for name, callback in self.callbacks.items():
+            values.append((name, (), callback()))
+        return [(name, tuple(extra_labels) + labels, value) for name, labels, value in values]
+
+    def export(self):
+        return self.format_values(self.definitions, self.collect())
+
+    @classmethod
+    def format_values(cls, definitions, values):
+        # Formato texto do Prometheus; as linhas de um mesmo nome ficam juntas
+        lines = []
+        described = set()
+        for name, labels, value in sorted(values, key=lambda x: x[0]):
+            metric_type, description, _ = definitions[name]
+            full_name = cls.PREFIX + name
+            if name not in described:
+                lines.append(f'# HELP {full_name} {description}')
+                lines.append(f'# TYPE {full_name} {metric_type}')
+                described.add(name)
+            if not isinstance(value, Histogram):
+                lines.append(f'{full_name}{cls.__format_labels(labels)} {value}')
+                continue
+            for bound, count in value.cumulative_counts():
+                bucket_labels = labels + (('le', '+Inf' if bound == float('inf') else bound),)
+                lines.append(
+                    f'{full_name}_bucket{cls.__format_labels(bucket_labels)} {count}')
+            lines.append(f'{full_name}_sum{cls.__format_labels(labels)} {value.sum}')
+            lines.append(f'{full_name}_count{cls.__format_labels(labels)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def __copy(cls, value):
+        if not isinstance(value, Histogram):
+            return value
+        histogram = Histogram(value.buckets)
+        histogram.counts = list(value.counts)
+        histogram.sum = value.sum
+        histogram.count = value.count
+        return histogram
+
+    @classmethod
+    def __format_labels(cls, labels):
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class MetricsExporter:
+    def __init__(self, metrics: MetricsRegistry) -> None:
+        self.metrics = metrics
+        self.http_server = None
+        self.dump_file = None
+        self.dump_interval = None
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def start_http_server(self, address, port):
+        metrics = self.metrics
+
+        class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ['/', '/metrics']:
+                    self.send_error(404)
+                    return
+                body = metrics.export().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = http.server.ThreadingHTTPServer(
+            (address, port), MetricsRequestHandler)
+        self.__start_thread(self.http_server.serve_forever)
+        print(f'Metricas disponiveis em http://{address}:{self.http_server.server_port}/metrics')
+
+    def start_dump(self, dump_file, interval):
+        self.dump_file = dump_file
+        self.dump_interval = interval
+        self.__start_thread(self.__dump_periodically)
+
+    def write_dump(self):
+        temporary_file = self.dump_file + '.tmp'
+        with open(temporary_file, 'w') as file:
+            file.write(self.metrics.export())
+        os.replace(temporary_file, self.dump_file)
+
+    def stop(self):
+        self.stopped.set()
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+        for thread in self.threads:
+            thread.join()
+        if self.dump_file is not None:
+            self.write_dump()
+
+    def __dump_periodically(self):
+        while not self.stopped.wait(self.dump_interval):
+            self.write_dump()
+
+    def __start_thread(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self.threads.append(thread)
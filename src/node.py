@@ -1,148 +1,797 @@
+import random
 import socket
 import threading
-from src.messages import MessageBuilder, MessageDecoder, OperationType, MessageArguments
-from src.commands import CommandFactory, ICommand, CommandType, CommandMode
+import time
+import concurrent.futures
+from src.messages import MessageBuilder, OperationType, MessageArguments
+from src.commands import CANCELLABLE_MODES, CommandFactory, ICommand, CommandType, CommandMode
+from src.connections import ConnectionPool
+from src.caches import SeenCache, BPStateTable, ResultCache, ReplicaCache, ReversePathTable
+from src.framing import FrameEncoder, FrameReader, FramingType, FrameTooLargeException
+from src.codec import BinaryCodec, CodecType, MessageCodec
+from src.storage import MmapKeyValueStore
+from src.batch import PendingSearches
+from src.digests import KeyDigest
+from src.routing import AdaptiveRoutingTable
+from src.failures import FailureDetector, PeerState
+from src.workers import Priority, WorkerPool
+from src.transport import DATAGRAM_OPERATIONS, UDP_CAPABILITY, DatagramTransport, TransportType
+from src.metrics import MetricsRegistry
+from src.logs import current_node, get_logger
+
+message_log = get_logger('messages')
+neighbour_log = get_logger('neighbours')
+connection_log = get_logger('connections')
 
 
 class NodeServer:
-    def __init__(self, address, port, neighbours, key_value, should_run_flag, message_builder: MessageBuilder) -> None:
+    BOOTSTRAP_WORKERS = 256
+
+    def __init__(self, address, port, neighbours, key_value, should_run_flag, message_builder: MessageBuilder,
+                 framing_type: FramingType = FramingType.QUOTED, send_timeout=5, fanout_workers=32,
+                 result_cache_size=1024, result_cache_ttl=30, codec_type: CodecType = CodecType.BINARY,
+                 key_store='dict', walkers=4, walker_check_interval=4, ring_hop_timeout=0.1,
+                 ring_max_ttl=None, ring_reports=False, cancel_searches=False, val_routing='direct',
+                 replica_cache_size=256, replica_cache_ttl=30, replica_admission=2, key_digests=False, digest_depth=2,
+                 digest_bits=16384, digest_interval=30, adaptive_routing=False, routing_exploration=0.1,
+                 routing_buckets=64, heartbeat_interval=0, evict_after=3, worker_threads=16,
+                 worker_queue_size=1024, max_connections=256, low_priority_ttl=1,
+                 transport_type: TransportType = TransportType.TCP, datagram_acks=True, ack_timeout=0.2,
+                 ack_retries=3) -> None:
         self.address = address
         self.port = port
         self.origin = f"{self.address}:{self.port}"
         self.neighbours = []
+        # O bootstrap, os HELLOs recebidos e as readmissoes podem adicionar
+        # o mesmo vizinho ao mesmo tempo
+        self.neighbours_lock = threading.Lock()
         self.message_builder = message_builder
-        self.__initialize_neighbours(neighbours)
+        self.framing_type = framing_type
+        self.codec_type = codec_type
+        self.peer_codecs = {}
+        self.codecs_announced = set()
+        self.send_timeout = send_timeout
+        self.walkers = walkers
+        self.walker_check_interval = walker_check_interval
+        self.ring_hop_timeout = ring_hop_timeout
+        self.ring_max_ttl = ring_max_ttl
+        self.ring_reports = ring_reports
+        self.cancel_searches = cancel_searches
+        self.val_routing = val_routing
+        self.key_digests = key_digests
+        self.digest_depth = digest_depth
+        self.digest_bits = digest_bits
+        self.digest_interval = digest_interval
+        # vizinho -> KeyDigest recebido; vizinho -> ultimo resumo enviado
+        self.neighbour_digests = {}
+        self.digests_sent = {}
+        self.adaptive_routing = adaptive_routing
+        self.routing_table = AdaptiveRoutingTable(routing_exploration, routing_buckets)
+        self.heartbeat_interval = heartbeat_interval
+        self.failure_detector = FailureDetector(evict_after)
+        # Usado pelo servidor com threads: as threads de leitura so decodificam
+        # e enfileiram, e o pool processa as mensagens
+        self.worker_pool = WorkerPool(worker_threads, worker_queue_size)
+        self.max_connections = max_connections
+        self.low_priority_ttl = low_priority_ttl
+        # Com UDP, SEARCH, VAL, RVAL e CANCEL vao por datagrama aos vizinhos
+        # que anunciaram UDP no HELLO; as buscas BP esperam confirmacao
+        self.datagram_transport = DatagramTransport(address, port, ack_timeout, ack_retries) \
+            if transport_type == TransportType.UDP else None
+        self.datagram_acks = datagram_acks
+        self.datagram_peers = set()
+        self.metrics = MetricsRegistry()
+        self.define_metrics()
+        self.connection_pool = ConnectionPool(send_timeout)
+        self.fanout_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=fanout_workers, thread_name_prefix='fanout')
+        self.initialize_neighbours(neighbours)
         self.key_value = {}
-        self.__initialize_key_val(key_value)
-        self.flooding_messages_seen = {}
-        self.bp_search_info = {}
-        self.stats_counter = {
-            CommandMode.FL.value: 0,
-            CommandMode.RW.value: 0,
-            CommandMode.BP.value: 0
-        }
-        self.stats_mean = {
-            CommandMode.FL.value: [0, 0],
-            CommandMode.RW.value: [0, 0],
-            CommandMode.BP.value: [0, 0]
-        }
+        self.__initialize_key_val(key_value, key_store)
+        self.flooding_messages_seen = SeenCache()
+        # origem:seqno de buscas que passaram por este no e das ja respondidas
+        self.searches_received = SeenCache()
+        self.resolved_searches = SeenCache()
+        self.bp_search_info = BPStateTable()
+        self.result_cache = ResultCache(result_cache_size, result_cache_ttl)
+        self.reverse_paths = ReversePathTable()
+        self.replica_cache = ReplicaCache(replica_cache_size, replica_cache_ttl, replica_admission)
+        self.pending_searches = PendingSearches()
         self.should_run_flag = should_run_flag
+        self.listening = threading.Event()
         pass
 
-    def __initialize_key_val(self, key_value):
+    def define_metrics(self):
+        metrics = self.metrics
+        metrics.define_counter('messages_received_total',
+                               'Mensagens recebidas por operacao e modo')
+        metrics.define_counter('messages_sent_total',
+                               'Mensagens enviadas com sucesso por operacao e modo')
+        metrics.define_counter('send_failures_total',
+                               'Envios que falharam por vizinho')
+        metrics.define_histogram('send_latency_seconds',
+                                 'Tempo para conectar e enviar uma mensagem, por vizinho')
+        metrics.define_counter('searches_seen_total',
+                               'Mensagens de busca recebidas por modo')
+        metrics.define_histogram('search_hops', 'Saltos ate encontrar a chave, por modo',
+                                 MetricsRegistry.HOP_BUCKETS)
+        metrics.define_histogram('search_rings', 'Aneis usados pelas buscas ER respondidas',
+                                 MetricsRegistry.HOP_BUCKETS)
+        metrics.define_counter('searches_cancelled_total',
+                               'Copias de busca descartadas por ja terem sido respondidas, por modo')
+        metrics.define_counter('cancels_sent_total', 'Cancelamentos iniciados por este no')
+        metrics.define_counter('cancels_received_total', 'Cancelamentos novos recebidos')
+        metrics.define_counter('vals_relayed_total', 'VALs repassados pelo caminho reverso da busca')
+        metrics.define_counter('digests_received_total', 'Resumos de chaves recebidos de vizinhos')
+        metrics.define_counter('digests_sent_total', 'Resumos de chaves enviados a vizinhos')
+        metrics.define_counter('digest_routed_total',
+                               'Encaminhamentos restritos aos vizinhos cujo resumo pode conter a chave')
+        metrics.define_counter('routing_explorations_total',
+                               'Proximos saltos de RW e BP escolhidos ao acaso pela tabela adaptativa',
+                               lambda: self.routing_table.explorations)
+        metrics.define_counter('routing_exploitations_total',
+                               'Proximos saltos de RW e BP escolhidos pela melhor pontuacao',
+                               lambda: self.routing_table.exploitations)
+        metrics.define_histogram('search_round_trip_seconds',
+                                 'Tempo entre o envio de uma busca por este no e a chegada do VAL')
+        metrics.define_counter('seen_cache_hits_total', 'Mensagens de flooding duplicadas descartadas',
+                               lambda: self.flooding_messages_seen.hits)
+        metrics.define_counter('seen_cache_evictions_total', 'Origens removidas do cache de mensagens vistas',
+                               lambda: self.flooding_messages_seen.evictions)
+        metrics.define_counter('result_cache_hits_total', 'Buscas respondidas pelo cache de resultados',
+                               lambda: self.result_cache.hits)
+        metrics.define_counter('result_cache_misses_total', 'Consultas ao cache de resultados sem resposta',
+                               lambda: self.result_cache.misses)
+        metrics.define_counter('replica_cache_hits_total', 'Buscas respondidas pelo cache de replicas',
+                               lambda: self.replica_cache.hits)
+        metrics.define_counter('replica_cache_rejections_total',
+                               'Valores recusados pelo cache de replicas por pouca procura',
+                               lambda: self.replica_cache.rejections)
+        metrics.define_gauge('replica_cache_entries', 'Valores no cache de replicas',
+                             lambda: len(self.replica_cache))
+        metrics.define_gauge('bp_searches_active', 'Buscas em profundidade com estado neste no',
+                             lambda: len(self.bp_search_info))
+        metrics.define_gauge('pending_searches', 'Buscas iniciadas por este no aguardando VAL',
+                             lambda: len(self.pending_searches))
+        metrics.define_gauge('outbound_connections', 'Conexoes abertas para vizinhos',
+                             lambda: len(self.connection_pool.connections))
+        metrics.define_gauge('inbound_connections', 'Conexoes recebidas abertas')
+        metrics.define_counter('connections_rejected_total',
+                               'Conexoes recusadas por atingir o limite de conexoes recebidas')
+        metrics.define_gauge('worker_queue_depth', 'Mensagens recebidas aguardando processamento',
+                             lambda: len(self.worker_pool))
+        metrics.define_counter('messages_rejected_total',
+                               'Mensagens descartadas na chegada com a fila de processamento cheia',
+                               lambda: self.worker_pool.rejected)
+        metrics.define_counter('messages_shed_total',
+                               'Mensagens tiradas da fila para dar lugar a outras de maior prioridade',
+                               lambda: self.worker_pool.shed)
+        metrics.define_gauge('neighbours', 'Vizinhos na tabela', lambda: len(self.neighbours))
+        metrics.define_gauge('neighbours_suspect', 'Vizinhos com envios falhando, ainda na tabela',
+                             lambda: self.failure_detector.count(PeerState.SUSPECT))
+        metrics.define_gauge('neighbours_down', 'Vizinhos removidos da tabela por falhas seguidas',
+                             lambda: self.failure_detector.count(PeerState.DOWN))
+        metrics.define_counter('neighbour_evictions_total', 'Vizinhos removidos por falhas seguidas')
+        metrics.define_counter('neighbour_readmissions_total', 'Vizinhos removidos que voltaram a responder')
+        if self.datagram_transport is None:
+            return
+        metrics.define_counter('datagrams_sent_total', 'Datagramas UDP enviados, incluindo ACKs e retransmissoes',
+                               lambda: self.datagram_transport.sent)
+        metrics.define_counter('datagram_retransmissions_total', 'Buscas BP reenviadas por falta de ACK',
+                               lambda: self.datagram_transport.retransmissions)
+        metrics.define_counter('datagram_ack_failures_total',
+                               'Buscas BP sem ACK depois de todas as retransmissoes',
+                               lambda: self.datagram_transport.ack_failures)
+        metrics.define_counter('datagram_duplicates_total', 'Retransmissoes recebidas de datagramas ja entregues',
+                               lambda: self.datagram_transport.duplicates)
+
+    def record_message_received(self, message):
+        self.metrics.increment('messages_received_total', operation=message.operation,
+                               mode=self.get_mode_label(message))
+
+    def record_message_sent(self, message, target, started_at):
+        self.metrics.increment('messages_sent_total', operation=message.operation,
+                               mode=self.get_mode_label(message))
+        self.metrics.observe('send_latency_seconds',
+                             time.monotonic() - started_at, peer=target)
+        if self.failure_detector.record_success(target):
+            self.readmit_neighbour(target)
+
+    def record_send_failure(self, target):
+        self.metrics.increment('send_failures_total', peer=target)
+        # So vizinhos entram no detector; o VAL direto para a origem nao
+        if target in self.neighbours and self.failure_detector.record_failure(target):
+            self.evict_neighbour(target)
+
+    def evict_neighbour(self, neighbour):
+        # Os codecs negociados sao mantidos: ao voltar, o vizinho ja nos
+        # anunciou os dele e nao repetiria o anuncio
+        self.remove_neighbour(neighbour)
+        self.close_connection(neighbour)
+        self.neighbour_digests.pop(neighbour, None)
+        self.digests_sent.pop(neighbour, None)
+        self.metrics.increment('neighbour_evictions_total')
+        neighbour_log.warning('Vizinho %s nao responde, removido da tabela', neighbour)
+
+    def add_neighbour(self, neighbour):
+        # Devolve False se o vizinho ja estava na tabela
+        with self.neighbours_lock:
+            if neighbour in self.neighbours:
+                return False
+            self.neighbours.append(neighbour)
+            return True
+
+    def remove_neighbour(self, neighbour):
+        # Devolve False se o vizinho nao estava na tabela
+        with self.neighbours_lock:
+            if neighbour not in self.neighbours:
+                return False
+            self.neighbours.remove(neighbour)
+            return True
+
+    def readmit_neighbour(self, neighbour):
+        self.add_neighbour(neighbour)
+        self.metrics.increment('neighbour_readmissions_total')
+        neighbour_log.warning('Vizinho %s voltou a responder, readmitido na tabela', neighbour)
+        if self.key_digests and neighbour in self.peer_codecs:
+            self.send_key_digest(neighbour)
+
+    @classmethod
+    def get_mode_label(cls, message):
+        return message.get_argument_val(MessageArguments.MODE) or 'DEFAULT'
+
+    def __initialize_key_val(self, key_value, key_store):
         if key_value == '':
             return
+        if isinstance(key_value, dict):
+            self.key_value = dict(key_value)
+            return
+        if key_store == 'mmap':
+            self.key_value = MmapKeyValueStore.open(key_value)
+            return
         with open(key_value, 'r') as file:
             for line in file.readlines():
                 key, value = line.strip().split(' ')
                 self.key_value[key] = value
 
-    def __initialize_neighbours(self, neighbours):
-        with open(neighbours, 'r') as file:
-            neighbours_adresses = [x.strip() for x in file.readlines()]
-        for neighbour in neighbours_adresses:
-            message = (self.message_builder
-                       .build_operation(OperationType.HELLO)
-                       .build_origin(self.origin)
-                       .get_message())
-            command: ICommand = CommandFactory.create_command(
-                CommandType.HELLO)
-            command.execute_as_sender(self, message, neighbour)
-            if command.success:
-                self.neighbours.append(neighbour)
+    def initialize_neighbours(self, neighbours):
+        # Chamado pelo construtor; o host.py passa [] e chama de novo quando
+        # todos os nos ja aceitam conexoes
+        current_node.set(self.origin)
+        if isinstance(neighbours, str):
+            with open(neighbours, 'r') as file:
+                neighbours_adresses = [x.strip() for x in file.readlines()]
+        else:
+            neighbours_adresses = list(neighbours)
+        neighbours_adresses = list(dict.fromkeys(
+            x for x in neighbours_adresses if x))
+        self.bootstrap_report = {'added': [], 'rejected': []}
+        if neighbours_adresses:
+            # Os HELLOs sao enviados em paralelo; cada um e limitado pelo
+            # send_timeout do socket, entao o tempo total e o do vizinho mais lento.
+            max_workers = min(len(neighbours_adresses), self.BOOTSTRAP_WORKERS)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                       thread_name_prefix='bootstrap') as executor:
+                results = list(executor.map(self.__send_bootstrap_hello,
+                                            neighbours_adresses))
+            for neighbour, success in zip(neighbours_adresses, results):
+                if success:
+                    # O HELLO do proprio vizinho pode te-lo adicionado antes
+                    self.add_neighbour(neighbour)
+                    self.bootstrap_report['added'].append(neighbour)
+                else:
+                    self.bootstrap_report['rejected'].append(neighbour)
+            self.print_bootstrap_report()
         self.message_builder.restart_seq_count()
 
+    def __send_bootstrap_hello(self, neighbour):
+        message = self.build_hello_message()
+        command: ICommand = CommandFactory.create_command(
+            CommandType.HELLO)
+        command.execute_as_sender(self, message, neighbour)
+        return command.success
+
+    def print_bootstrap_report(self):
+        neighbour_log.info('Vizinhos adicionados (%d): %s', len(self.bootstrap_report['added']),
+                           ' '.join(self.bootstrap_report['added']))
+        if self.bootstrap_report['rejected']:
+            neighbour_log.warning('Vizinhos que nao responderam (%d): %s', len(self.bootstrap_report['rejected']),
+                                  ' '.join(self.bootstrap_report['rejected']))
+
+    def get_hello_arguments(self):
+        if self.codec_type == CodecType.TEXT:
+            return {}
+        codecs = [CodecType.TEXT.value, self.codec_type.value]
+        if self.datagram_transport is not None:
+            codecs.append(UDP_CAPABILITY)
+        return {
+            MessageArguments.MODE.value: 'DEFAULT',
+            MessageArguments.CODECS.value: ','.join(codecs),
+            MessageArguments.LAST_HOP_PORT.value: str(self.port),
+            MessageArguments.HOP_COUNT.value: 0
+        }
+
+    def build_hello_message(self):
+        return (self.message_builder
+                .build_operation(OperationType.HELLO)
+                .build_origin(self.origin)
+                .build_arguments(self.get_hello_arguments())
+                .get_message())
+
+    def register_peer_codecs(self, peer, codecs):
+        if codecs in ['DEFAULT', '']:
+            self.peer_codecs.pop(peer, None)
+            self.datagram_peers.discard(peer)
+            return
+        if UDP_CAPABILITY in codecs.split(','):
+            self.datagram_peers.add(peer)
+        else:
+            self.datagram_peers.discard(peer)
+        if self.codec_type.value in codecs.split(','):
+            self.peer_codecs[peer] = self.codec_type
+            return
+        self.peer_codecs[peer] = CodecType.TEXT
+
+    def request_peer_codecs(self):
+        # Vizinhos que responderam ao HELLO antes deste no aceitar conexoes
+        # nao conseguiram anunciar seus codecs; um novo HELLO pede o anuncio.
+        if self.codec_type == CodecType.TEXT:
+            return
+        for neighbour in self.neighbours.copy():
+            if neighbour in self.peer_codecs:
+                continue
+            command = CommandFactory.create_command(CommandType.HELLO)
+            command.execute_as_sender(self, self.build_hello_message(), neighbour)
+
+    def get_negotiated_neighbours(self):
+        # So vizinhos que negociaram pelo HELLO conhecem as operacoes novas
+        # (CANCEL, RVAL, DIGEST)
+        return [x for x in self.neighbours if x in self.peer_codecs]
+
+    def build_key_digest(self):
+        neighbour_digests = [self.neighbour_digests[x] for x in self.neighbours
+                             if x in self.neighbour_digests]
+        return KeyDigest.build(self.key_value.keys(), neighbour_digests, self.digest_depth,
+                               self.digest_bits).encode()
+
+    def send_key_digest(self, target, encoded_digest=None):
+        encoded_digest = encoded_digest or self.build_key_digest()
+        if self.digests_sent.get(target) == encoded_digest:
+            return None
+        message = (self.message_builder
+                   .build_origin(self.origin)
+                   .build_operation(OperationType.DIGEST)
+                   .build_arguments({
+                       MessageArguments.MODE.value: 'DEFAULT',
+                       MessageArguments.DIGEST.value: encoded_digest,
+                       MessageArguments.LAST_HOP_PORT.value: str(self.port),
+                       MessageArguments.HOP_COUNT.value: 0
+                   })
+                   .get_message())
+        command = CommandFactory.create_command(CommandType.DIGEST)
+        command.execute_as_sender(self, message, target)
+        return command
+
+    def record_digest_sent(self, target, encoded_digest):
+        self.digests_sent[target] = encoded_digest
+        self.metrics.increment('digests_sent_total')
+
+    def refresh_key_digests(self):
+        # Reenvia o resumo aos vizinhos cujo ultimo resumo recebido mudou: as
+        # chaves deste no ou os niveis herdados dos vizinhos
+        if not self.key_digests:
+            return []
+        encoded_digest = self.build_key_digest()
+        commands = [self.send_key_digest(target, encoded_digest) for target in self.get_negotiated_neighbours()]
+        return [command for command in commands if command is not None]
+
+    def select_by_digest(self, key, candidates):
+        # Vizinhos cujo resumo pode conter a chave no menor nivel; sem nenhum,
+        # segue com todos os candidatos
+        if not self.key_digests:
+            return candidates
+        best_level = None
+        selected = []
+        for candidate in candidates:
+            digest = self.neighbour_digests.get(candidate)
+            level = digest.match_level(key) if digest is not None else None
+            if level is None:
+                continue
+            if best_level is None or level < best_level:
+                best_level = level
+                selected = [candidate]
+            elif level == best_level:
+                selected.append(candidate)
+        if not selected:
+            return candidates
+        self.metrics.increment('digest_routed_total')
+        return selected
+
+    def choose_next_hop(self, message, candidates):
+        # message e a mensagem que sera enviada; candidates nao pode ser vazio
+        if not self.adaptive_routing:
+            return candidates[random.randint(0, len(candidates) - 1)]
+        key = message.get_argument_val(MessageArguments.KEY)
+        neighbour = self.routing_table.choose(key, candidates)
+        # Nos intermediarios so ficam sabendo do resultado se o VAL voltar
+        # pelo caminho da busca
+        if message.origin == self.origin or self.val_routing == 'reverse':
+            self.routing_table.record_forward(message.origin, message.seq_number, key, neighbour,
+                                              message.get_argument_val(MessageArguments.HOP_COUNT))
+        return neighbour
+
+    def start_background_tasks(self):
+        if self.key_digests and self.digest_interval:
+            threading.Thread(target=self.__refresh_digests_periodically,
+                             name='digests', daemon=True).start()
+        if self.heartbeat_interval:
+            threading.Thread(target=self.__send_heartbeats_periodically,
+                             name='heartbeats', daemon=True).start()
+
+    def send_heartbeats(self):
+        # HELLO serve de ping: o resultado do envio alimenta o detector de
+        # falhas, e os vizinhos removidos tambem recebem, para serem readmitidos
+        commands = []
+        for neighbour in self.neighbours.copy() + self.failure_detector.get_down_peers():
+            command = CommandFactory.create_command(CommandType.HELLO)
+            command.execute_as_sender(self, self.build_hello_message(), neighbour)
+            commands.append(command)
+        return commands
+
+    def __send_heartbeats_periodically(self):
+        current_node.set(self.origin)
+        while self.should_run_flag:
+            time.sleep(self.heartbeat_interval)
+            if self.should_run_flag:
+                self.send_heartbeats()
+
+    def __refresh_digests_periodically(self):
+        current_node.set(self.origin)
+        while self.should_run_flag:
+            time.sleep(self.digest_interval)
+            if self.should_run_flag:
+                self.refresh_key_digests()
+
+    def cancel_search(self, request):
+        message = (self.message_builder
+                   .build_origin(self.origin)
+                   .build_operation(OperationType.CANCEL)
+                   .build_arguments({
+                       MessageArguments.MODE.value: request.mode.value,
+                       MessageArguments.LAST_HOP_PORT.value: str(self.port),
+                       MessageArguments.KEY.value: request.key,
+                       MessageArguments.HOP_COUNT.value: 1
+                   })
+                   .build_seq_number(request.seq_number)
+                   .get_message(False))
+        command = CommandFactory.create_command(CommandType.CANCEL, request.mode)
+        command.execute_as_sender(self, message)
+        self.metrics.increment('cancels_sent_total')
+        return command
+
+    def forget_peer_codecs(self, peer):
+        self.peer_codecs.pop(peer, None)
+        self.datagram_peers.discard(peer)
+        self.codecs_announced.discard(peer)
+        self.neighbour_digests.pop(peer, None)
+        self.digests_sent.pop(peer, None)
+
     def execute_client_command(self, command: ICommand, arguments: dict, target=None):
         message = (self.message_builder
                    .build_origin(self.origin)
                    .build_operation(OperationType[command.command])
                    .build_arguments(arguments)
                    .get_message())
+        request = None
+        if command.command == CommandType.SEARCH.value:
+            # Registra antes de enviar para medir o tempo ate o VAL; buscas
+            # sem resposta expiram em PendingSearches
+            request = self.pending_searches.register(
+                message.seq_number, message.get_argument_val(MessageArguments.KEY), CommandMode(command.mode))
         result = command.execute_as_sender(self, message, target)
-        if command.success and command.command == CommandType.SEARCH.value:
+        if request is not None and command.success:
+            self.pending_searches.remove(request)
             print(f'Valor encontrado: {result}')
 
     def initialize_socket(self):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.settimeout(1)
         self.socket.bind((self.address, int(self.port)))
         self.socket.listen()
+        self.start_datagram_receiver()
+        self.worker_pool.start()
+        self.listening.set()
+        self.request_peer_codecs()
+        self.start_background_tasks()
         self.running_threads = []
         while self.should_run_flag:
             try:
                 conn, address = self.socket.accept()
-                request_thread = threading.Thread(target=self.handle_request,
-                                                  args=(conn,))
-                request_thread.start()
-                self.running_threads.append(request_thread)
             except TimeoutError:
                 continue
+            self.running_threads = [x for x in self.running_threads if x.is_alive()]
+            if len(self.running_threads) >= self.max_connections:
+                connection_log.warning('Limite de %d conexoes atingido, recusando %s:%d',
+                                       self.max_connections, *address)
+                self.metrics.increment('connections_rejected_total')
+                conn.close()
+                continue
+            request_thread = threading.Thread(target=self.handle_request,
+                                              args=(conn,))
+            request_thread.start()
+            self.running_threads.append(request_thread)
         for thread in self.running_threads:
             if thread.is_alive():
                 thread.join()
+        self.worker_pool.stop()
+        self.fanout_executor.shutdown(wait=False)
+        self.connection_pool.close_all()
         self.socket.close()
 
     def handle_request(self, conn: socket.socket):
-        data = conn.recv(1024)
-        if not data:
+        conn.settimeout(1)
+        frame_reader = FrameReader()
+        self.metrics.increment('inbound_connections')
+        try:
+            while self.should_run_flag:
+                try:
+                    data = conn.recv(4096)
+                except TimeoutError:
+                    continue
+                except OSError:
+                    break
+                if not data:
+                    break
+                try:
+                    messages = frame_reader.feed(data)
+                except FrameTooLargeException as exception:
+                    connection_log.warning('Conexao descartada: %s', exception.message)
+                    break
+                for message in messages:
+                    # A conexao e reutilizada: um quadro invalido nao pode
+                    # derrubar as mensagens seguintes
+                    try:
+                        self.enqueue_received_message(message, conn)
+                    except Exception as exception:
+                        connection_log.warning('Mensagem invalida descartada: %s', exception)
+        finally:
+            conn.close()
+            self.metrics.increment('inbound_connections', -1)
+
+    def get_message_priority(self, message):
+        if message.operation != OperationType.SEARCH.value:
+            return Priority.CONTROL
+        if message.ttl <= self.low_priority_ttl:
+            return Priority.LOW
+        if self.resolved_searches.contains(message.origin, message.seq_number):
+            return Priority.LOW
+        if message.get_argument_val(MessageArguments.MODE) in [CommandMode.FL.value, CommandMode.ER.value] and \
+                self.flooding_messages_seen.contains(message.origin, message.seq_number):
+            return Priority.LOW
+        return Priority.SEARCH
+
+    def start_datagram_receiver(self):
+        if self.datagram_transport is None:
             return
-        self.handle_received_message(data, conn)
-        conn.close()
+        self.datagram_transport.open()
+        threading.Thread(target=self.__receive_datagrams, name='datagrams', daemon=True).start()
+
+    def __receive_datagrams(self):
+        current_node.set(self.origin)
+        while self.should_run_flag:
+            try:
+                payload = self.datagram_transport.receive()
+                if payload is not None:
+                    self.handle_received_datagram(payload)
+            except Exception as exception:
+                connection_log.warning('Datagrama descartado: %s', exception)
+        self.datagram_transport.close()
+
+    def handle_received_datagram(self, data):
+        self.enqueue_received_message(data, None)
+
+    def enqueue_received_message(self, data, conn: socket.socket):
+        message = self.decode_received_message(data)
+        priority = self.get_message_priority(message)
+        if not self.worker_pool.submit(priority, self.process_received_message, message, conn):
+            message_log.debug('Fila de processamento cheia, mensagem descartada: %s', message)
+
+    def decode_received_message(self, data):
+        return MessageBuilder.build_received_message(MessageCodec.decode(data))
 
     def handle_received_message(self, message, conn: socket.socket):
-        decoded_message = MessageDecoder.decode(message)
-        operation = decoded_message['OPERATION']
-        message = (self.message_builder
-                   .build_arguments(decoded_message['ARGUMENTS'], operation == OperationType.VAL.value)
-                   .build_operation(OperationType[operation])
-                   .build_origin(decoded_message['ORIGIN'])
-                   .build_seq_number(decoded_message['SEQNO'])
-                   .build_ttl(decoded_message['TTL'])
-                   .get_message(False))
-        print(f'Mensagem recebida: {message}')
+        return self.process_received_message(self.decode_received_message(message), conn)
+
+    def process_received_message(self, message, conn: socket.socket):
+        current_node.set(self.origin)
+        operation = message.operation
+        message_log.debug('Mensagem recebida: %s', message)
+        self.record_message_received(message)
         command = CommandFactory.create_command(
             CommandType[operation], CommandMode[message.get_argument_val(MessageArguments.MODE)])
         result = command.execute_as_receiver(self, message)
+        executed_commands = [command]
         if operation == OperationType.SEARCH.value and command.success:
+            executed_commands.append(self.send_search_reply(message, result))
+        return executed_commands
+
+    def record_search_path(self, message, sender):
+        if message.origin == self.origin:
+            return
+        self.replica_cache.record_search(message.get_argument_val(MessageArguments.KEY))
+        if self.val_routing == 'reverse':
+            self.reverse_paths.add(message.origin, message.seq_number, sender)
+
+    def get_reply_target(self, message):
+        # O VAL so volta pelo caminho se o vizinho anterior conhece o RVAL
+        if self.val_routing != 'reverse':
+            return None
+        sender = f'{self.address}:{message.get_argument_val(MessageArguments.LAST_HOP_PORT)}'
+        return sender if sender in self.peer_codecs else None
+
+    def build_reply_message(self, operation_type: OperationType, origin, seq_number, arguments):
+        return (self.message_builder
+                .build_origin(origin)
+                .build_operation(operation_type)
+                .build_arguments(arguments, 1)
+                .build_seq_number(seq_number)
+                .get_message(False))
+
+    def build_direct_reply(self, message):
+        return self.build_reply_message(OperationType.VAL, self.origin, message.seq_number,
+                                        message.arguments.copy())
+
+    def send_search_reply(self, message, value):
+        arguments = {
+            MessageArguments.MODE.value: message.get_argument_val(MessageArguments.MODE),
+            MessageArguments.KEY.value: message.get_argument_val(MessageArguments.KEY),
+            MessageArguments.VALUE.value: value,
+            MessageArguments.HOP_COUNT.value: message.get_argument_val(
+                MessageArguments.HOP_COUNT)
+        }
+        previous_hop = self.get_reply_target(message)
+        if previous_hop is None:
             val_command = CommandFactory.create_command(CommandType.VAL)
-            arguments = {
-                MessageArguments.MODE.value: message.get_argument_val(MessageArguments.MODE),
-                MessageArguments.KEY.value: message.get_argument_val(MessageArguments.KEY),
-                MessageArguments.VALUE.value: result,
-                MessageArguments.HOP_COUNT.value: message.get_argument_val(
-                    MessageArguments.HOP_COUNT)
-            }
-            val_message = (self.message_builder
-                           .build_origin(self.origin)
-                           .build_operation(OperationType.VAL)
-                           .build_arguments(arguments, 1)
-                           .get_message())
-            val_command.execute_as_sender(self, val_message, message.origin)
+            val_command.execute_as_sender(self, self.build_reply_message(
+                OperationType.VAL, self.origin, message.seq_number, arguments), message.origin)
+            return val_command
+        val_command = CommandFactory.create_command(CommandType.RVAL)
+        val_command.execute_as_sender(self, self.build_reply_message(
+            OperationType.RVAL, message.origin, message.seq_number, arguments), previous_hop)
+        return val_command
 
     def list_neighbours(self):
         for index, neighbour in enumerate(self.neighbours):
-            print(f"\t[{index}] {neighbour.replace(':', ' ')}")
+            suspect = ' (suspeito)' if self.failure_detector.get_state(
+                neighbour) == PeerState.SUSPECT else ''
+            print(f"\t[{index}] {neighbour.replace(':', ' ')}{suspect}")
 
     def increment_stats_counter(self, mode: CommandMode):
-        self.stats_counter[mode.value] += 1
+        self.metrics.increment('searches_seen_total', mode=mode.value)
 
     def update_stats_mean(self, mode: CommandMode, val):
-        self.stats_mean[mode.value][0] += int(val)
-        self.stats_mean[mode.value][1] += 1
+        self.metrics.observe('search_hops', int(val), mode=mode.value)
+
+    def get_stats_counter(self, mode: CommandMode):
+        return self.metrics.get('searches_seen_total', mode=mode.value)
+
+    def get_stats_mean(self, mode: CommandMode):
+        _, mean = self.metrics.get('search_hops', mode=mode.value)
+        return mean
 
     @classmethod
     def print_sending_message(cls, message, target):
-        print(f'Encaminhando mensagem {str(message)} para {target}')
+        message_log.debug('Encaminhando mensagem %s para %s', message, target)
 
     @classmethod
     def print_message_successfully_sent(cls, message):
-        print(f'\tEnvio feito com sucesso: {str(message)}')
+        message_log.debug('\tEnvio feito com sucesso: %s', message)
+
+    def encode_message(self, message, target):
+        if self.peer_codecs.get(target) == CodecType.BINARY:
+            return FrameEncoder.encode(BinaryCodec.encode(message), FramingType.LENGTH)
+        return FrameEncoder.encode(str(message).encode(), self.framing_type)
+
+    def close_connection(self, target):
+        self.connection_pool.close(target)
+
+    def uses_persistent_connection(self, target):
+        # Nos antigos leem uma unica mensagem por conexao e a fecham; so quem
+        # anunciou codecs no HELLO separa varias mensagens na mesma conexao
+        return target in self.neighbours and target in self.peer_codecs
+
+    def encode_datagram(self, message, target):
+        # Mensagem codificada para ir por UDP, ou None se deve ir por TCP
+        if self.datagram_transport is None or target not in self.datagram_peers or \
+                message.operation not in DATAGRAM_OPERATIONS:
+            return None
+        payload = MessageCodec.encode(message, self.peer_codecs.get(target, CodecType.TEXT))
+        return payload if self.datagram_transport.fits(payload) else None
+
+    def needs_datagram_ack(self, message):
+        # Uma busca BP perdida para a travessia inteira: o no que a enviou
+        # nunca recebe a volta e nao tenta o proximo vizinho
+        return self.datagram_acks and message.operation == OperationType.SEARCH.value and \
+            message.get_argument_val(MessageArguments.MODE) == CommandMode.BP.value
 
     def send_message_to_target(self, message, target):
         self.print_sending_message(message, target)
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        address, port = target.split(':')
-        s.connect((address, int(port)))
-        s.send(bytes(str(message).encode()))
-        s.close()
+        started_at = time.monotonic()
+        try:
+            payload = self.encode_datagram(message, target)
+            if payload is not None:
+                self.datagram_transport.send(target, payload, self.needs_datagram_ack(message))
+            elif self.uses_persistent_connection(target):
+                self.connection_pool.send(target, self.encode_message(message, target))
+            else:
+                address, port = target.split(':')
+                with socket.create_connection((address, int(port)), timeout=self.send_timeout) as s:
+                    s.sendall(self.encode_message(message, target))
+        except OSError:
+            self.record_send_failure(target)
+            raise
+        self.record_message_sent(message, target, started_at)
         self.print_message_successfully_sent(message)
+
+    def send_to_next_hop(self, message, candidates, choose, on_choose=None, on_exhausted=None):
+        # Tenta os candidatos ate um envio dar certo, em vez de abortar a
+        # busca no primeiro vizinho fora do ar; a falha ja foi contada pelo
+        # detector de falhas. Sem nenhum alcancavel, chama on_exhausted.
+        candidates = list(candidates)
+        while candidates:
+            neighbour = choose(message, candidates)
+            if on_choose is not None:
+                on_choose(neighbour)
+            try:
+                self.send_message_to_target(message, neighbour)
+                return neighbour
+            except OSError as exception:
+                connection_log.warning('Erro ao enviar mensagem para %s: %s', neighbour, exception)
+                candidates.remove(neighbour)
+        if on_exhausted is not None:
+            on_exhausted()
+        return None
+
+    def is_cancelled_copy(self, message):
+        # Copias de uma busca que ficaram na fila ate ela ser respondida
+        if message.operation != OperationType.SEARCH.value:
+            return False
+        if not self.resolved_searches.contains(message.origin, message.seq_number):
+            return False
+        self.metrics.increment('searches_cancelled_total',
+                               mode=self.get_mode_label(message))
+        return True
+
+    def get_cancel_in_place(self, message, target):
+        # CANCEL no lugar de uma copia descartada pela marca: vai so por onde
+        # a busca ainda iria, com o TTL dela, e custa no maximo as mensagens
+        # que substitui
+        if not self.cancel_searches or target not in self.peer_codecs or \
+                CommandMode(message.get_argument_val(MessageArguments.MODE)) not in CANCELLABLE_MODES:
+            return None
+        return message.forward(self.port, OperationType.CANCEL, False)
+
+    def send_fanout_copy(self, message, target):
+        if self.is_cancelled_copy(message):
+            message = self.get_cancel_in_place(message, target)
+            if message is None:
+                return
+        self.send_message_to_target(message, target)
+
+    def send_message_to_targets(self, message, targets):
+        futures = {self.fanout_executor.submit(self.send_fanout_copy, message, target): target
+                   for target in targets}
+        done, not_done = concurrent.futures.wait(futures, timeout=self.send_timeout)
+        for future in done:
+            if future.exception() is not None:
+                self.print_fanout_failure(futures[future], future.exception())
+        for future in not_done:
+            self.print_fanout_failure(futures[future], TimeoutError())
+
+    @classmethod
+    def print_fanout_failure(cls, target, exception):
+        if isinstance(exception, TimeoutError):
+            connection_log.warning('Tempo esgotado ao enviar mensagem para %s', target)
+            return
+        connection_log.warning('Erro ao enviar mensagem para %s: %s', target, exception)
@@ -0,0 +1,114 @@
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+class NeighbourScore:
+    __slots__ = ('success_rate', 'hops', 'samples')
+
+    def __init__(self, success_rate, hops) -> None:
+        self.success_rate = success_rate
+        self.hops = hops
+        self.samples = 0
+
+    def update(self, success, hops, weight):
+        # Medias moveis exponenciais: a topologia e estavel, mas as chaves
+        # mais buscadas mudam
+        self.samples += 1
+        self.success_rate += weight * ((1 if success else 0) - self.success_rate)
+        if success:
+            self.hops += weight * (hops - self.hops)
+
+    @property
+    def score(self):
+        return self.success_rate / (1 + self.hops)
+
+
+class AdaptiveRoutingTable:
+    # Aprende, por vizinho e por faixa de hash da chave, a taxa de sucesso e
+    # os saltos restantes das buscas encaminhadas por ele. A escolha e gulosa
+    # pela melhor pontuacao, exceto numa fracao `exploration` das vezes.
+    PRIOR_SUCCESS_RATE = 0.5
+    PRIOR_HOPS = 4
+
+    def __init__(self, exploration=0.1, buckets=64, weight=0.2, expiry_seconds=10,
+                 max_pending=4096) -> None:
+        self.exploration = exploration
+        self.buckets = buckets
+        self.weight = weight
+        self.expiry_seconds = expiry_seconds
+        self.max_pending = max_pending
+        # (vizinho, faixa) -> NeighbourScore; a faixa None agrega todas
+        self.scores = {}
+        # origem:seqno -> (vizinho, faixa, HOP_COUNT enviado, expiracao)
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.explorations = 0
+        self.exploitations = 0
+
+    def get_bucket(self, key):
+        if self.buckets <= 1:
+            return None
+        return zlib.crc32(key.encode()) % self.buckets
+
+    def choose(self, key, candidates):
+        if len(candidates) > 1 and random.random() < self.exploration:
+            self.explorations += 1
+            return random.choice(candidates)
+        self.exploitations += 1
+        bucket = self.get_bucket(key)
+        with self.lock:
+            scores = [self.__get_score(candidate, bucket) for candidate in candidates]
+        best_score = max(scores)
+        return random.choice([candidate for candidate, score in zip(candidates, scores)
+                              if score == best_score])
+
+    def record_forward(self, origin, seq_number, key, neighbour, hop_count):
+        now = time.monotonic()
+        path_key = f'{origin}:{seq_number}'
+        with self.lock:
+            self.__remove_expired(now)
+            # A busca voltou a este no sem resposta: o vizinho anterior falhou
+            previous = self.pending.pop(path_key, None)
+            if previous is not None:
+                self.__update(previous, False)
+            self.pending[path_key] = (neighbour, self.get_bucket(key), int(hop_count),
+                                      now + self.expiry_seconds)
+            if len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+
+    def record_success(self, origin, seq_number, hop_count):
+        with self.lock:
+            entry = self.pending.pop(f'{origin}:{seq_number}', None)
+            if entry is None:
+                return
+            # Saltos a partir deste no, contando o salto ate o vizinho
+            self.__update(entry, True, int(hop_count) - entry[2] + 1)
+
+    def __get_score(self, neighbour, bucket):
+        score = self.scores.get((neighbour, bucket)) or self.scores.get((neighbour, None))
+        if score is None:
+            return self.PRIOR_SUCCESS_RATE / (1 + self.PRIOR_HOPS)
+        return score.score
+
+    def __update(self, entry, success, hops=None):
+        neighbour, bucket, _, _ = entry
+        for score_key in {(neighbour, bucket), (neighbour, None)}:
+            score = self.scores.get(score_key)
+            if score is None:
+                score = NeighbourScore(self.PRIOR_SUCCESS_RATE, self.PRIOR_HOPS)
+                self.scores[score_key] = score
+            score.update(success, hops, self.weight)
+
+    def __remove_expired(self, now):
+        while self.pending:
+            path_key, entry = next(iter(self.pending.items()))
+            if entry[3] > now:
+                return
+            del self.pending[path_key]
+            self.__update(entry, False)
+
+    def __len__(self):
+        return len(self.pending)
@@ -0,0 +1,369 @@
+import concurrent.futures
+import math
+import random
+import threading
+import time
+from collections import Counter
+from src.node import NodeServer
+from src.messages import MessageBuilder, Message
+from src.commands import CommandMode
+from src.framing import FrameReader, FramingType
+from src.codec import CodecType
+from src.batch import BatchSearch
+from src.logs import get_logger
+
+connection_log = get_logger('connections')
+
+
+class Topology:
+    NAMES = ['ring', 'grid', 'random', 'scale-free']
+
+    @classmethod
+    def ring(cls, size, seed=None):
+        adjacency = cls.__empty(size)
+        if size > 1:
+            for index in range(size):
+                cls.__connect(adjacency, index, (index + 1) % size)
+        return adjacency
+
+    @classmethod
+    def grid(cls, size, seed=None):
+        adjacency = cls.__empty(size)
+        columns = math.ceil(math.sqrt(size))
+        for index in range(size):
+            if (index + 1) % columns != 0 and index + 1 < size:
+                cls.__connect(adjacency, index, index + 1)
+            if index + columns < size:
+                cls.__connect(adjacency, index, index + columns)
+        return adjacency
+
+    @classmethod
+    def random(cls, size, seed=None, degree=4):
+        # Arvore aleatoria para garantir que o grafo seja conexo, completada
+        # com arestas aleatorias ate o grau medio pedido.
+        generator = random.Random(seed)
+        adjacency = cls.__empty(size)
+        for index in range(1, size):
+            cls.__connect(adjacency, index, generator.randrange(index))
+        target_edges = min(size * degree // 2, size * (size - 1) // 2)
+        edges = size - 1
+        while edges < target_edges:
+            first, second = generator.randrange(size), generator.randrange(size)
+            if first != second and second not in adjacency[first]:
+                cls.__connect(adjacency, first, second)
+                edges += 1
+        return adjacency
+
+    @classmethod
+    def scale_free(cls, size, seed=None, edges_per_node=2):
+        # Barabasi-Albert: cada novo no se liga a nos ja existentes com
+        # probabilidade proporcional ao grau deles.
+        generator = random.Random(seed)
+        adjacency = cls.__empty(size)
+        initial = min(edges_per_node + 1, size)
+        for index in range(initial):
+            for other in range(index):
+                cls.__connect(adjacency, index, other)
+        endpoints = [node for node in range(initial)
+                     for _ in adjacency[node]]
+        for index in range(initial, size):
+            targets = set()
+            while len(targets) < min(edges_per_node, index):
+                targets.add(generator.choice(endpoints))
+            for target in targets:
+                cls.__connect(adjacency, index, target)
+                endpoints += [index, target]
+        return adjacency
+
+    @classmethod
+    def build(cls, name, size, seed=None):
+        return getattr(cls, name.replace('-', '_'))(size, seed)
+
+    @classmethod
+    def __empty(cls, size):
+        return [set() for _ in range(size)]
+
+    @classmethod
+    def __connect(cls, adjacency, first, second):
+        adjacency[first].add(second)
+        adjacency[second].add(first)
+
+
+class TrafficCounter:
+    def __init__(self) -> None:
+        # operacao -> numero de mensagens enviadas
+        self.counter = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, message: Message):
+        with self.lock:
+            self.counter[message.operation] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return Counter(self.counter)
+
+
+class InMemoryNetwork:
+    def __init__(self, workers=8) -> None:
+        # origem -> no registrado
+        self.nodes = {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='network')
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def register(self, node):
+        self.nodes[node.origin] = node
+
+    def unregister(self, node):
+        self.nodes.pop(node.origin, None)
+
+    def deliver(self, target, data: bytes):
+        node = self.nodes.get(target)
+        if node is None:
+            raise ConnectionRefusedError(f'{target} nao esta na rede')
+        with self.condition:
+            self.in_flight += 1
+        self.executor.submit(self.__handle, node, data)
+
+    def wait_idle(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.in_flight == 0, timeout)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def __handle(self, node, data: bytes):
+        try:
+            for message in FrameReader().feed(data):
+                node.handle_received_message(message, None)
+        except Exception as exception:
+            connection_log.warning('Erro ao processar mensagem em %s: %s', node.origin, exception)
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                if self.in_flight == 0:
+                    self.condition.notify_all()
+
+
+class InMemoryNodeServer(NodeServer):
+    def __init__(self, *args, network: InMemoryNetwork = None, traffic: TrafficCounter = None, **kwargs) -> None:
+        # Precisam existir antes do construtor da base, que ja envia os HELLOs
+        self.network = network
+        self.traffic = traffic
+        super().__init__(*args, **kwargs)
+
+    def initialize_socket(self):
+        self.network.register(self)
+        self.listening.set()
+        self.request_peer_codecs()
+        self.start_background_tasks()
+        while self.should_run_flag:
+            time.sleep(0.5)
+        self.network.unregister(self)
+        self.fanout_executor.shutdown(wait=False)
+
+    def close_connection(self, target):
+        pass
+
+    def send_message_to_target(self, message, target):
+        self.print_sending_message(message, target)
+        self.traffic.record(message)
+        started_at = time.monotonic()
+        try:
+            self.network.deliver(target, self.encode_message(message, target))
+        except OSError:
+            self.record_send_failure(target)
+            raise
+        self.record_message_sent(message, target, started_at)
+        self.print_message_successfully_sent(message)
+
+    def send_message_to_targets(self, message, targets):
+        # A entrega so enfileira a mensagem, entao nao ha o que paralelizar
+        for target in targets:
+            try:
+                self.send_message_to_target(message, target)
+            except OSError as exception:
+                self.print_fanout_failure(target, exception)
+
+
+class LoopbackNodeServer(NodeServer):
+    def __init__(self, *args, traffic: TrafficCounter = None, **kwargs) -> None:
+        self.traffic = traffic
+        super().__init__(*args, **kwargs)
+
+    def send_message_to_target(self, message, target):
+        self.traffic.record(message)
+        super().send_message_to_target(message, target)
+
+
+class ModeReport:
+    def __init__(self, mode: CommandMode, requests, traffic: Counter, elapsed) -> None:
+        self.mode = mode
+        self.searches = len(requests)
+        found = [x for x in requests if not x.timed_out]
+        self.found = len(found)
+        self.messages = sum(traffic.values())
+        self.traffic = traffic
+        self.elapsed = elapsed
+        self.mean_hops = sum(x.hop_count for x in found) / \
+            len(found) if found else 0
+        rings = [x.rings for x in found if x.rings is not None]
+        self.mean_rings = sum(rings) / len(rings) if rings else None
+        latencies = sorted(x.latency for x in found)
+        self.latency_percentiles = {
+            fraction: percentile(latencies, fraction) for fraction in (0.5, 0.9, 0.99)
+        }
+
+    @property
+    def success_rate(self):
+        return self.found / self.searches if self.searches else 0
+
+    @classmethod
+    def print_header(cls):
+        print(f'{"modo":<4} {"buscas":>7} {"sucesso":>8} {"mensagens":>10} {"msg/busca":>10} '
+              f'{"saltos":>7} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"tempo s":>8} {"aneis":>6}')
+
+    def print(self):
+        p50, p90, p99 = (self.latency_percentiles[x] * 1000
+                         for x in (0.5, 0.9, 0.99))
+        per_search = self.messages / self.searches if self.searches else 0
+        rings = f'{self.mean_rings:.2f}' if self.mean_rings is not None else '-'
+        print(f'{self.mode.value:<4} {self.searches:>7} {self.success_rate:>8.1%} {self.messages:>10} '
+              f'{per_search:>10.1f} {self.mean_hops:>7.2f} {p50:>8.2f} {p90:>8.2f} {p99:>8.2f} '
+              f'{self.elapsed:>8.2f} {rings:>6}')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+class Simulation:
+    TRANSPORTS = ['memory', 'loopback']
+    IDLE_TIMEOUT = 30
+
+    def __init__(self, adjacency, transport='memory', address='127.0.0.1', base_port=20000,
+                 codec_type: CodecType = CodecType.BINARY, framing_type: FramingType = FramingType.QUOTED,
+                 send_timeout=5, network_workers=8, fanout_workers=4, result_cache_size=0,
+                 settle_seconds=1, node_options=None) -> None:
+        self.adjacency = adjacency
+        self.transport = transport
+        self.address = address
+        self.base_port = base_port
+        self.codec_type = codec_type
+        self.framing_type = framing_type
+        self.send_timeout = send_timeout
+        self.fanout_workers = fanout_workers
+        self.result_cache_size = result_cache_size
+        self.settle_seconds = settle_seconds
+        # Demais argumentos nomeados repassados a cada NodeServer
+        self.node_options = node_options or {}
+        self.traffic = TrafficCounter()
+        self.network = InMemoryNetwork(
+            network_workers) if transport == 'memory' else None
+        self.nodes = []
+        self.server_threads = []
+        # chave -> indice do no que a armazena
+        self.key_owners = {}
+        # indices dos nos derrubados por fail_nodes
+        self.failed = set()
+
+    def get_origin(self, index):
+        return f'{self.address}:{self.base_port + index}'
+
+    def start(self):
+        # Os nos sobem em ordem: cada um so envia HELLO depois que os
+        # anteriores ja aceitam mensagens, como em uma rede real.
+        for index, neighbours in enumerate(self.adjacency):
+            node = self.__create_node(index, neighbours)
+            thread = threading.Thread(target=node.initialize_socket)
+            thread.start()
+            node.listening.wait()
+            self.nodes.append(node)
+            self.server_threads.append(thread)
+        self.__settle()
+
+    def place_keys(self, count, seed=None):
+        generator = random.Random(seed)
+        for key_index in range(count):
+            key = f'chave{key_index}'
+            owner = generator.randrange(len(self.nodes))
+            self.nodes[owner].key_value[key] = f'valor{key_index}'
+            self.key_owners[key] = owner
+        # Cada rodada leva os resumos de chaves um salto adiante
+        rounds = self.nodes[0].digest_depth if self.nodes and self.nodes[0].key_digests else 0
+        for _ in range(rounds):
+            for node in self.nodes:
+                node.refresh_key_digests()
+            self.__settle()
+
+    def fail_nodes(self, count, seed=None):
+        # Derruba nos sem BYE, como uma queda: os vizinhos so percebem ao
+        # tentar enviar para eles
+        generator = random.Random(seed)
+        for index in generator.sample(range(len(self.nodes)), count):
+            node = self.nodes[index]
+            node.should_run_flag = False
+            if self.network is not None:
+                self.network.unregister(node)
+            self.failed.add(index)
+
+    def run_workload(self, mode: CommandMode, searches, concurrency=8, timeout=5, seed=None, skew=0):
+        generator = random.Random(seed)
+        # So chaves de nos no ar, buscadas a partir de nos no ar
+        keys = [key for key, owner in self.key_owners.items() if owner not in self.failed]
+        alive = [index for index in range(len(self.nodes)) if index not in self.failed]
+        # Zipf: a i-esima chave e buscada com peso 1 / i ** skew
+        weights = [1 / (rank + 1) ** skew for rank in range(len(keys))]
+        workload = []
+        for _ in range(searches):
+            key = generator.choices(keys, weights)[0]
+            # A origem nunca tem a chave, senao a busca termina sem mensagens
+            origin = generator.randrange(len(alive) - 1)
+            if alive[origin] >= self.key_owners[key]:
+                origin += 1
+            workload.append((self.nodes[alive[origin]], key))
+        traffic_before = self.traffic.snapshot()
+        started_at = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            requests = list(executor.map(
+                lambda item: BatchSearch(item[0], mode, timeout=timeout).search(item[1]), workload))
+        elapsed = time.monotonic() - started_at
+        self.__settle()
+        traffic = self.traffic.snapshot()
+        traffic.subtract(traffic_before)
+        return ModeReport(mode, requests, +traffic, elapsed)
+
+    def stop(self):
+        for node in self.nodes:
+            node.should_run_flag = False
+        for thread in self.server_threads:
+            thread.join()
+        if self.network is not None:
+            self.network.shutdown()
+
+    def __create_node(self, index, neighbours):
+        arguments = (self.address, str(self.base_port + index),
+                     [self.get_origin(x) for x in sorted(neighbours)], {}, True, MessageBuilder(),
+                     self.framing_type, self.send_timeout, self.fanout_workers)
+        options = {
+            'result_cache_size': self.result_cache_size,
+            'codec_type': self.codec_type,
+            'traffic': self.traffic,
+            **self.node_options
+        }
+        if self.transport == 'memory':
+            return InMemoryNodeServer(*arguments, network=self.network, **options)
+        return LoopbackNodeServer(*arguments, **options)
+
+    def __settle(self):
+        # Espera o trafego residual (inundacoes, retrocessos do BP) terminar.
+        # Sobre sockets nao ha como saber, entao apenas aguarda um intervalo.
+        if self.network is not None:
+            self.network.wait_idle(self.IDLE_TIMEOUT)
+            return
+        time.sleep(self.settle_seconds)
@@ -0,0 +1,143 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+
+class MmapKeyValueStore:
+    # Indice: cabecalho seguido de pares (hash da chave, offset da linha no
+    # arquivo de chaves), ordenados por hash para busca binaria.
+    HEADER = struct.Struct('!8sQQ')
+    RECORD = struct.Struct('!QQ')
+    MAGIC = b'EPKVIDX1'
+    INDEX_SUFFIX = '.idx'
+
+    def __init__(self, data_file, index_file) -> None:
+        self.data_file = data_file
+        self.index_file = index_file
+        self.data = self.__map(data_file)
+        self.index = self.__map(index_file)
+        _, _, self.count = self.HEADER.unpack_from(self.index)
+
+    @classmethod
+    def open(cls, data_file, index_file=None):
+        index_file = index_file or data_file + cls.INDEX_SUFFIX
+        if not cls.is_index_valid(data_file, index_file):
+            cls.build_index(data_file, index_file)
+        return cls(data_file, index_file)
+
+    @classmethod
+    def is_index_valid(cls, data_file, index_file):
+        if not os.path.exists(index_file):
+            return False
+        if os.path.getmtime(index_file) < os.path.getmtime(data_file):
+            return False
+        with open(index_file, 'rb') as file:
+            header = file.read(cls.HEADER.size)
+        if len(header) < cls.HEADER.size:
+            return False
+        magic, data_size, _ = cls.HEADER.unpack(header)
+        return magic == cls.MAGIC and data_size == os.path.getsize(data_file)
+
+    @classmethod
+    def build_index(cls, data_file, index_file):
+        records = []
+        with open(data_file, 'rb') as file:
+            offset = 0
+            for line in file:
+                key = line.split(b' ', 1)[0].strip()
+                if key:
+                    records.append((cls.hash_key(key), offset))
+                offset += len(line)
+        records.sort()
+        temporary_file = index_file + '.tmp'
+        with open(temporary_file, 'wb') as file:
+            file.write(cls.HEADER.pack(cls.MAGIC, offset, len(records)))
+            for record in records:
+                file.write(cls.RECORD.pack(*record))
+        os.replace(temporary_file, index_file)
+
+    @classmethod
+    def hash_key(cls, key: bytes):
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big')
+
+    def get(self, key, default=None):
+        encoded_key = key.encode()
+        key_hash = self.hash_key(encoded_key)
+        position = self.__lower_bound(key_hash)
+        value = default
+        while position < self.count:
+            record_hash, offset = self.RECORD.unpack_from(
+                self.index, self.HEADER.size + position * self.RECORD.size)
+            if record_hash != key_hash:
+                break
+            line_key, line_value = self.__read_line(offset)
+            # Chaves repetidas: vale a ultima do arquivo, como no dict
+            if line_key == encoded_key:
+                value = line_value.decode()
+            position += 1
+        return value
+
+    def keys(self):
+        if not self.data:
+            return
+        offset = 0
+        while offset < len(self.data):
+            end = self.data.find(b'\n', offset)
+            end = len(self.data) if end < 0 else end
+            key = self.data[offset:end].split(b' ', 1)[0].strip()
+            if key:
+                yield key.decode()
+            offset = end + 1
+
+    def close(self):
+        self.index.close()
+        if self.data:
+            self.data.close()
+
+    def __lower_bound(self, key_hash):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            (record_hash, _) = self.RECORD.unpack_from(
+                self.index, self.HEADER.size + middle * self.RECORD.size)
+            if record_hash < key_hash:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __read_line(self, offset):
+        end = self.data.find(b'\n', offset)
+        line = self.data[offset:end if end >= 0 else len(self.data)].strip()
+        key, _, value = line.partition(b' ')
+        return key, value.strip()
+
+    @classmethod
+    def __map(cls, path):
+        if os.path.getsize(path) == 0:
+            return None
+        with open(path, 'rb') as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __len__(self):
+        return self.count
+
+
+if __name__ == '__main__':
+    # python -m src.storage arquivo_de_chaves [arquivo_de_indice]
+    data_file = sys.argv[1]
+    index_file = sys.argv[2] if len(
+        sys.argv) > 2 else data_file + MmapKeyValueStore.INDEX_SUFFIX
+    MmapKeyValueStore.build_index(data_file, index_file)
+    print(f'Indice criado em {index_file}')
@@ -0,0 +1,159 @@
+import asyncio
+import itertools
+import socket
+import struct
+import threading
+from collections import OrderedDict
+from enum import Enum
+from src.messages import OperationType
+
+
+class TransportType(Enum):
+    TCP = 'tcp'
+    UDP = 'udp'
+
+
+# Anunciado no HELLO junto com os codecs; nos antigos ignoram valores que
+# nao conhecem
+UDP_CAPABILITY = 'udp'
+# Mensagens pequenas cuja perda ja e tolerada pelo TTL, pela deduplicacao e
+# pelos timeouts das buscas. HELLO, BYE e os resumos de chaves seguem por TCP.
+DATAGRAM_OPERATIONS = [OperationType.SEARCH.value, OperationType.VAL.value,
+                       OperationType.RVAL.value, OperationType.CANCEL.value]
+
+
+class DatagramTransport:
+    # Socket UDP do no, na mesma porta do servidor TCP. Cada datagrama leva
+    # um cabecalho (tipo, identificador) e uma mensagem codificada, sem
+    # framing. Envios confiaveis esperam o ACK do destino e retransmitem
+    # ate `ack_retries` vezes; o destino confirma cada copia e descarta as
+    # retransmissoes que ja entregou.
+    HEADER = struct.Struct('!BI')
+    DATA = 0
+    RELIABLE = 1
+    ACK = 2
+    # Cabe em um quadro Ethernet sem fragmentar; mensagens maiores vao por TCP
+    MAX_DATAGRAM_SIZE = 1400
+
+    def __init__(self, address, port, ack_timeout=0.2, ack_retries=3, delivered_size=4096) -> None:
+        self.address = address
+        self.port = int(port)
+        self.ack_timeout = ack_timeout
+        self.ack_retries = ack_retries
+        self.delivered_size = delivered_size
+        self.socket = None
+        self.ids = itertools.count(1)
+        # identificador -> funcao que avisa quem espera o ACK
+        self.pending = {}
+        # (remetente, identificador) dos envios confiaveis ja entregues
+        self.delivered = OrderedDict()
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.retransmissions = 0
+        self.ack_failures = 0
+        self.duplicates = 0
+
+    def open(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.settimeout(1)
+        self.socket.bind((self.address, self.port))
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+
+    def fits(self, payload: bytes):
+        return self.HEADER.size + len(payload) <= self.MAX_DATAGRAM_SIZE
+
+    def send(self, target, payload: bytes, reliable=False):
+        # Levanta TimeoutError (um OSError, como as falhas de TCP) se o
+        # destino nao confirmar um envio confiavel; send_to_next_hop entao
+        # tenta outro vizinho ou retrocede
+        destination = self.get_destination(target)
+        if not reliable:
+            self.__send_datagram(self.DATA, 0, payload, destination)
+            return
+        acknowledged = threading.Event()
+        datagram_id = self.__register(acknowledged.set)
+        try:
+            for attempt in range(self.ack_retries + 1):
+                self.__send_attempt(attempt, datagram_id, payload, destination)
+                if acknowledged.wait(self.ack_timeout):
+                    return
+            self.__fail(target)
+        finally:
+            del self.pending[datagram_id]
+
+    async def async_send_reliable(self, target, payload: bytes):
+        # O mesmo envio confiavel, esperando o ACK no event loop em vez de
+        # ocupar uma thread por busca BP em andamento
+        loop = asyncio.get_running_loop()
+        destination = self.get_destination(target)
+        acknowledged = asyncio.Event()
+        datagram_id = self.__register(lambda: loop.call_soon_threadsafe(acknowledged.set))
+        try:
+            for attempt in range(self.ack_retries + 1):
+                self.__send_attempt(attempt, datagram_id, payload, destination)
+                try:
+                    await asyncio.wait_for(acknowledged.wait(), self.ack_timeout)
+                    return
+                except asyncio.TimeoutError:
+                    continue
+            self.__fail(target)
+        finally:
+            del self.pending[datagram_id]
+
+    @classmethod
+    def get_destination(cls, target):
+        address, port = target.split(':')
+        return address, int(port)
+
+    def receive(self):
+        # Espera um datagrama; devolve a mensagem a processar ou None (ACK,
+        # retransmissao repetida ou tempo esgotado)
+        try:
+            datagram, sender = self.socket.recvfrom(65535)
+        except TimeoutError:
+            return None
+        if len(datagram) < self.HEADER.size:
+            raise ValueError(f'datagrama de {len(datagram)} bytes')
+        kind, datagram_id = self.HEADER.unpack_from(datagram)
+        if kind == self.ACK:
+            acknowledge = self.pending.get(datagram_id)
+            if acknowledge is not None:
+                acknowledge()
+            return None
+        if kind == self.RELIABLE:
+            self.__send_datagram(self.ACK, datagram_id, b'', sender)
+            if not self.__first_delivery(sender, datagram_id):
+                self.duplicates += 1
+                return None
+        return datagram[self.HEADER.size:]
+
+    def __register(self, acknowledge):
+        datagram_id = next(self.ids) & 0xFFFFFFFF
+        self.pending[datagram_id] = acknowledge
+        return datagram_id
+
+    def __send_attempt(self, attempt, datagram_id, payload, destination):
+        if attempt:
+            self.retransmissions += 1
+        self.__send_datagram(self.RELIABLE, datagram_id, payload, destination)
+
+    def __fail(self, target):
+        self.ack_failures += 1
+        raise TimeoutError(f'{target} nao confirmou o datagrama')
+
+    def __first_delivery(self, sender, datagram_id):
+        key = (sender, datagram_id)
+        with self.lock:
+            if key in self.delivered:
+                return False
+            self.delivered[key] = True
+            if len(self.delivered) > self.delivered_size:
+                self.delivered.popitem(last=False)
+            return True
+
+    def __send_datagram(self, kind, datagram_id, payload, destination):
+        self.socket.sendto(self.HEADER.pack(kind, datagram_id) + payload, destination)
+        self.sent += 1
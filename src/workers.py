@@ -0,0 +1,92 @@
+import threading
+from collections import deque
+from enum import IntEnum
+from src.logs import get_logger
+
+connection_log = get_logger('connections')
+
+
+class Priority(IntEnum):
+    # HELLO, BYE, VAL, CANCEL...: poucas mensagens e caras de perder
+    CONTROL = 0
+    SEARCH = 1
+    # Copias repetidas de inundacoes, buscas ja respondidas ou com pouco TTL
+    LOW = 2
+
+
+class WorkerPool:
+    # Numero fixo de threads consumindo uma fila limitada, atendida em ordem
+    # de prioridade. Com a fila cheia, uma mensagem nova tira da fila a mais
+    # antiga de uma prioridade menor; se nao houver nenhuma, e recusada.
+    # Mensagens de controle ainda tem uma reserva alem do limite.
+    def __init__(self, workers=16, queue_size=1024, name='worker') -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+        self.control_reserve = queue_size // 4 + 1
+        self.name = name
+        self.queues = [deque() for _ in Priority]
+        self.size = 0
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.threads = []
+        self.rejected = 0
+        self.shed = 0
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.__work, name=f'{self.name}-{index}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, priority: Priority, function, *args):
+        with self.condition:
+            if self.stopped:
+                return False
+            if self.size >= self.queue_size:
+                victim = next((x for x in reversed(Priority) if x > priority and self.queues[x]), None)
+                if victim is not None:
+                    self.queues[victim].popleft()
+                    self.size -= 1
+                    self.shed += 1
+                elif priority != Priority.CONTROL or self.size >= self.queue_size + self.control_reserve:
+                    self.rejected += 1
+                    return False
+            self.queues[priority].append((function, args))
+            self.size += 1
+            self.condition.notify()
+        return True
+
+    def stop(self):
+        # Descarta o que ainda esta na fila e espera as tarefas em andamento
+        with self.condition:
+            self.stopped = True
+            for queue in self.queues:
+                queue.clear()
+            self.size = 0
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def __next_task(self):
+        with self.condition:
+            while not self.size and not self.stopped:
+                self.condition.wait()
+            if self.stopped:
+                return None
+            queue = next(x for x in self.queues if x)
+            self.size -= 1
+            return queue.popleft()
+
+    def __work(self):
+        while True:
+            task = self.__next_task()
+            if task is None:
+                return
+            function, args = task
+            try:
+                function(*args)
+            except Exception as exception:
+                connection_log.warning('Erro ao processar mensagem: %s', exception)
+
+    def __len__(self):
+        return self.size